@@ -4,18 +4,28 @@ import logging
 import json
 import csv
 import re
-from datetime import datetime, timedelta
+import sqlite3
+import hashlib
+import tempfile
+import heapq
+import random
+import unicodedata
+import html
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional, Tuple, Set
 from pathlib import Path
 from dotenv import load_dotenv
-from telethon import TelegramClient, events
-from telethon.errors import ChannelPrivateError, RPCError
-from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, User
+from telethon import TelegramClient, events, utils
+from telethon.errors import ChannelPrivateError, RPCError, FloodWaitError
+from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, User, Channel
 from telethon.tl.functions.channels import GetParticipantsRequest
-from telethon.tl.types import ChannelParticipantsSearch
+from telethon.tl.types import ChannelParticipantsSearch, DocumentAttributeFilename
+from telethon.tl.types import (
+    InputMessagesFilterPhotos, InputMessagesFilterVideo, InputMessagesFilterDocument,
+    InputMessagesFilterVoice, InputMessagesFilterMusic, InputMessagesFilterGif, InputMessagesFilterUrl
+)
 import google.generativeai as genai
-from collections import defaultdict, Counter
-import schedule
+from collections import defaultdict, Counter, OrderedDict, deque
 import threading
 import time
 
@@ -40,23 +50,650 @@ EXPORTS_DIR.mkdir(exist_ok=True)
 MEDIA_ARCHIVE_DIR = Path("atlas_media_archive")
 MEDIA_ARCHIVE_DIR.mkdir(exist_ok=True)
 
+# Sender/entity cache tuning
+SENDER_CACHE_SIZE = int(os.getenv("ATLAS_SENDER_CACHE_SIZE", "5000"))
+SENDER_CACHE_TTL = int(os.getenv("ATLAS_SENDER_CACHE_TTL", "3600"))
+
+# Local message archive
+ARCHIVE_DB_PATH = Path(os.getenv("ATLAS_ARCHIVE_DB", "atlas_archive.db"))
+ARCHIVE_BATCH_SIZE = 500
+# Most new messages pulled into an indexed chat before a local search
+ARCHIVE_CATCHUP_LIMIT = int(os.getenv("ATLAS_ARCHIVE_CATCHUP_LIMIT", "2000"))
+
+# Map-reduce analysis for histories larger than one prompt
+ANALYSIS_CHUNK_TOKENS = int(os.getenv("ATLAS_ANALYSIS_CHUNK_TOKENS", "100000"))
+ANALYSIS_MAP_CONCURRENCY = int(os.getenv("ATLAS_ANALYSIS_MAP_CONCURRENCY", "4"))
+CHARS_PER_TOKEN = 4  # Rough estimate used for chunk budgeting
+
+# Persistent LLM response cache
+LLM_CACHE_ENABLED = os.getenv("ATLAS_LLM_CACHE", "1") != "0"
+LLM_CACHE_DB_PATH = Path(os.getenv("ATLAS_LLM_CACHE_DB", "atlas_llm_cache.db"))
+LLM_CACHE_TTL = int(os.getenv("ATLAS_LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("ATLAS_LLM_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Gemini request scheduling: priority lanes (lower runs first), limits and overflow policy
+PRIORITY_INTERACTIVE = 0
+PRIORITY_AUTOMOD = 1
+PRIORITY_MONITOR = 2
+PRIORITY_REPORT = 3
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_AUTOMOD: 'auto-mod',
+    PRIORITY_MONITOR: 'monitor',
+    PRIORITY_REPORT: 'report'
+}
+GEMINI_CONCURRENCY = int(os.getenv("ATLAS_GEMINI_CONCURRENCY", "4"))
+GEMINI_RPM = int(os.getenv("ATLAS_GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("ATLAS_GEMINI_TPM", "1000000"))
+GEMINI_MAX_QUEUE = int(os.getenv("ATLAS_GEMINI_MAX_QUEUE", "50"))
+GEMINI_MAX_RETRIES = int(os.getenv("ATLAS_GEMINI_MAX_RETRIES", "4"))
+# When a lane is full, 'defer' waits for room and 'drop' sheds the request
+GEMINI_OVERFLOW_POLICY = {
+    PRIORITY_INTERACTIVE: 'defer',
+    PRIORITY_AUTOMOD: 'drop',
+    PRIORITY_MONITOR: 'drop',
+    PRIORITY_REPORT: 'defer'
+}
+
+# Spam classification: messages per model call, per-message text cap,
+# how long auto-mod waits to fill a micro-batch, and its default action threshold
+SPAM_BATCH_SIZE = int(os.getenv("ATLAS_SPAM_BATCH_SIZE", "25"))
+SPAM_TEXT_MAX_CHARS = int(os.getenv("ATLAS_SPAM_TEXT_MAX_CHARS", "1000"))
+AUTOMOD_BATCH_WINDOW = float(os.getenv("ATLAS_AUTOMOD_BATCH_WINDOW", "1.5"))
+AUTOMOD_BAN_THRESHOLD = float(os.getenv("ATLAS_AUTOMOD_BAN_THRESHOLD", "0.9"))
+
+# Local spam pre-filter: scores at/above SPAM are settled as spam, at/below HAM as clean,
+# anything between goes to the model. Extra blocked domains come from a comma list and/or a file.
+SPAM_HEURISTICS_ENABLED = os.getenv("ATLAS_SPAM_HEURISTICS", "1") != "0"
+SPAM_HEURISTIC_SPAM = float(os.getenv("ATLAS_SPAM_HEURISTIC_SPAM", "0.85"))
+SPAM_HEURISTIC_HAM = float(os.getenv("ATLAS_SPAM_HEURISTIC_HAM", "0.15"))
+# A low score alone never settles clean: the message must also be short, link/mention/money
+# free chat from an established-looking sender (username, photo, not a bot or new account)
+SPAM_HAM_MAX_WORDS = int(os.getenv("ATLAS_SPAM_HAM_MAX_WORDS", "8"))
+SPAM_BLOCKED_DOMAINS = [d.strip().lower() for d in os.getenv("ATLAS_SPAM_BLOCKED_DOMAINS", "").split(",") if d.strip()]
+SPAM_BLOCKLIST_FILE = os.getenv("ATLAS_SPAM_BLOCKLIST_FILE", "")
+# Telegram user ids are allocated roughly in order; ids above this are treated as recent accounts
+SPAM_NEW_ACCOUNT_ID = int(os.getenv("ATLAS_SPAM_NEW_ACCOUNT_ID", "7000000000"))
+
+# Near-duplicate flood detection: recent-message window (count and age), estimated
+# Jaccard similarity that still counts as a variant, and minimum text length considered.
+# Only spam verdicts at or above the auto-mod threshold are shared across a cluster.
+DUP_WINDOW_SIZE = int(os.getenv("ATLAS_DUP_WINDOW_SIZE", "5000"))
+DUP_WINDOW_TTL = int(os.getenv("ATLAS_DUP_WINDOW_TTL", "3600"))
+DUP_MIN_SIMILARITY = float(os.getenv("ATLAS_DUP_MIN_SIMILARITY", "0.6"))
+DUP_MIN_CHARS = int(os.getenv("ATLAS_DUP_MIN_CHARS", "20"))
+
+# Messages per batch yielded by AtlasClient.iter_history_batches
+HISTORY_BATCH_SIZE = int(os.getenv("ATLAS_HISTORY_BATCH_SIZE", "500"))
+
+# Time-window scans (--since / --between): cap on messages read when no explicit limit is given
+WINDOW_SCAN_LIMIT = int(os.getenv("ATLAS_WINDOW_SCAN_LIMIT", "5000"))
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Media analysis pipeline worker pools
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv("ATLAS_MEDIA_DOWNLOAD_WORKERS", "4"))
+MEDIA_ANALYSIS_WORKERS = int(os.getenv("ATLAS_MEDIA_ANALYSIS_WORKERS", "3"))
+
+# Persistent cache of media analyses
+MEDIA_CACHE_DB_PATH = Path(os.getenv("ATLAS_MEDIA_CACHE_DB", "atlas_media_cache.db"))
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv("ATLAS_MEDIA_CACHE_MAX_ENTRIES", "20000"))
+
+# Sender reputation for auto-moderation: evidence decays with this half-life; senders at/above
+# REPUTATION_BAD spam weight are actioned without AI, and at/above REPUTATION_TRUSTED
+# model-confirmed clean messages (with no recent spam) skip classification
+REPUTATION_DB_PATH = Path(os.getenv("ATLAS_REPUTATION_DB", "atlas_reputation.db"))
+REPUTATION_HALF_LIFE = int(os.getenv("ATLAS_REPUTATION_HALF_LIFE", str(7 * 24 * 3600)))
+REPUTATION_BAD = float(os.getenv("ATLAS_REPUTATION_BAD", "3.0"))
+REPUTATION_TRUSTED = float(os.getenv("ATLAS_REPUTATION_TRUSTED", "20.0"))
+# Spam weight added per event
+REPUTATION_WEIGHTS = {'verdict': 1.0, 'auto_delete': 2.0, 'manual_delete': 3.0}
+
+# Outbound sends (alerts, reports, replies) share one account-wide budget. The rate halves on
+# FloodWait (not below the floor) and creeps back up by one message/minute per successful send.
+SEND_PRIORITY_REPLY = 0
+SEND_PRIORITY_ALERT = 1
+SEND_PRIORITY_BULK = 2
+SEND_PRIORITY_NAMES = {SEND_PRIORITY_REPLY: 'reply', SEND_PRIORITY_ALERT: 'alert', SEND_PRIORITY_BULK: 'bulk'}
+OUTBOUND_PER_MINUTE = float(os.getenv("ATLAS_OUTBOUND_PER_MINUTE", "40"))
+OUTBOUND_MIN_PER_MINUTE = float(os.getenv("ATLAS_OUTBOUND_MIN_PER_MINUTE", "6"))
+OUTBOUND_BURST = float(os.getenv("ATLAS_OUTBOUND_BURST", "5"))
+
+# Reports longer than this are delivered as a short inline summary plus one document
+# (0 disables). Format: auto (html or md to match the parse mode), html, md or txt.
+REPORT_DOCUMENT_THRESHOLD = int(os.getenv("ATLAS_REPORT_DOCUMENT_THRESHOLD", "12000"))
+REPORT_DOCUMENT_FORMAT = os.getenv("ATLAS_REPORT_DOCUMENT_FORMAT", "auto")
+REPORT_SUMMARY_CHARS = int(os.getenv("ATLAS_REPORT_SUMMARY_CHARS", "1200"))
+
+# Auto-forward queues: messages arriving within the window go out in one forward call
+# (Telegram accepts up to 100 ids); trailing albums get a short grace period to complete
+FORWARD_BATCH_WINDOW = float(os.getenv("ATLAS_FORWARD_BATCH_WINDOW", "1.0"))
+FORWARD_MAX_BATCH = 100
+FORWARD_ALBUM_GRACE = 0.5
+FORWARD_MAX_RETRIES = int(os.getenv("ATLAS_FORWARD_MAX_RETRIES", "5"))
+
+# Edit history for .watch-events: messages tracked per chat (LRU) and versions kept per message
+EDIT_HISTORY_PER_CHAT = int(os.getenv("ATLAS_EDIT_HISTORY_PER_CHAT", "1000"))
+EDIT_HISTORY_MAX_VERSIONS = int(os.getenv("ATLAS_EDIT_HISTORY_MAX_VERSIONS", "20"))
+
+# Recent-message ring buffer for recovering deleted content (.watch-events --deletes):
+# per-chat bounds by count and bytes, with evicted entries optionally spilled to SQLite
+RING_BUFFER_MAX_MESSAGES = int(os.getenv("ATLAS_RING_BUFFER_MAX_MESSAGES", "5000"))
+RING_BUFFER_MAX_BYTES = int(os.getenv("ATLAS_RING_BUFFER_MAX_BYTES", str(4 * 1024 * 1024)))
+RING_SPILL_ENABLED = os.getenv("ATLAS_RING_SPILL", "0") == "1"
+RING_SPILL_DB_PATH = Path(os.getenv("ATLAS_RING_SPILL_DB", "atlas_ring_spill.db"))
+RING_SPILL_MAX_ROWS = int(os.getenv("ATLAS_RING_SPILL_MAX_ROWS", "200000"))
+RING_SPILL_FLUSH_ROWS = 200
+
+# Persistent job scheduler (.schedule-report): run time for daily/weekly jobs (local time),
+# random delay spread over each run, and how many jobs may run at once
+JOBS_DB_PATH = Path(os.getenv("ATLAS_JOBS_DB", "atlas_jobs.db"))
+JOB_RUN_TIME = os.getenv("ATLAS_REPORT_TIME", "09:00")
+JOB_JITTER = float(os.getenv("ATLAS_JOB_JITTER", "300"))
+JOB_CATCHUP_JITTER = float(os.getenv("ATLAS_JOB_CATCHUP_JITTER", "60"))
+JOB_MAX_CONCURRENT = int(os.getenv("ATLAS_JOB_MAX_CONCURRENT", "2"))
+JOB_FREQUENCIES = ('hourly', 'daily', 'weekly')
+# Incremental reports: first-run window per frequency, how many of those windows one run may
+# read (any backlog carries into later runs) and length cap for the rolling summary
+REPORT_SEED_LIMITS = {'hourly': 100, 'daily': 500, 'weekly': 1000}
+REPORT_RUN_WINDOWS = int(os.getenv("ATLAS_REPORT_RUN_WINDOWS", "2"))
+ROLLING_SUMMARY_WORDS = int(os.getenv("ATLAS_ROLLING_SUMMARY_WORDS", "400"))
+
+# Media-type filters Telegram can evaluate server-side (.search --type)
+SEARCH_MEDIA_FILTERS = {
+    'photos': InputMessagesFilterPhotos,
+    'videos': InputMessagesFilterVideo,
+    'documents': InputMessagesFilterDocument,
+    'voice': InputMessagesFilterVoice,
+    'music': InputMessagesFilterMusic,
+    'gifs': InputMessagesFilterGif,
+    'links': InputMessagesFilterUrl
+}
+
+# Media up to this size is analyzed from memory as inline data; larger files spill to a temp file
+MEDIA_INLINE_MAX_BYTES = int(os.getenv("ATLAS_MEDIA_INLINE_MAX_BYTES", str(15 * 1024 * 1024)))
+
 # --- INTELLIGENCE MODULE (AI) ---
+class ResponseCache:
+    """
+    Persistent cache of model responses keyed on model name, system instruction,
+    prompt and a hash of any attached media, with TTL and size-based LRU eviction.
+    """
+
+    def __init__(self, db_path: Path = LLM_CACHE_DB_PATH, ttl: int = LLM_CACHE_TTL,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created INTEGER NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+        """)
+        self.conn.commit()
+        self._total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def hash_payload(payload) -> str:
+        """SHA-256 of in-memory bytes or of a file's contents"""
+        if isinstance(payload, bytes):
+            return hashlib.sha256(payload).hexdigest()
+        digest = hashlib.sha256()
+        with open(payload, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(model_name: str, system_instruction: str, prompt: str, content_hash: str = '') -> str:
+        digest = hashlib.sha256()
+        for part in (model_name, system_instruction, prompt, content_hash):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = int(time.time())
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT response, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[2] + self.ttl < now:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= row[1]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, response: str):
+        size = len(response.encode('utf-8'))
+        now = int(time.time())
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._total_bytes -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._total_bytes += size
+
+            # Evict least recently used entries until back under the size budget
+            while self._total_bytes > self.max_bytes:
+                victims = self.conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_used ASC LIMIT 100"
+                ).fetchall()
+                if not victims:
+                    break
+                for victim_key, victim_size in victims:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (victim_key,))
+                    self._total_bytes -= victim_size
+                    if self._total_bytes <= self.max_bytes:
+                        break
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class SpamHeuristics:
+    """
+    Fast local spam scoring from precompiled rules, domain blocklists,
+    character-class and sender features. settle() returns a verdict for
+    clear spam, or for clear ham (low score plus is_plain_chat), and None
+    for everything else so the model decides.
+    """
+
+    # Bare hosts (no scheme or www.) only count with a TLD common in spam, so file names,
+    # version strings and abbreviations like report.pdf, v1.2 or e.g. aren't links
+    URL_TLDS = (
+        'com', 'net', 'org', 'info', 'biz', 'io', 'co', 'me', 'ly', 'gg', 'cc', 'tv', 'to', 'ai', 'app', 'dev',
+        'xyz', 'top', 'site', 'online', 'shop', 'store', 'club', 'live', 'link', 'click', 'fun', 'icu', 'vip',
+        'win', 'bet', 'pro', 'tk', 'ml', 'ga', 'cf', 'gq', 'pw', 'ru', 'su', 'ua', 'kz', 'by', 'uk', 'us', 'de',
+        'cn', 'in', 'ir', 'tr', 'br'
+    )
+    URL_RE = re.compile(
+        r'(?<![\w@.-])(?:(?:https?://|www\.)((?:[a-z0-9-]+\.)+[a-z]{2,})'
+        r'|((?:[a-z0-9-]+\.)+(?:' + '|'.join(URL_TLDS) + r')))(?![\w-])(?:/[^\s]*)?',
+        re.IGNORECASE
+    )
+    INVITE_RE = re.compile(r't(?:elegram)?\.me/(?:\+|joinchat/)[\w-]+', re.IGNORECASE)
+    WALLET_RE = re.compile(
+        r'\b(?:0x[a-fA-F0-9]{40}|bc1[a-z0-9]{25,59}|[13][a-km-zA-HJ-NP-Z1-9]{25,34}|T[A-Za-z1-9]{33})\b'
+    )
+    SCAM_RE = re.compile(
+        r'\b(?:airdrop|giveaway|free crypto|double your|guaranteed (?:profit|returns?)|investment plan|'
+        r'passive income|dm me|message me|click (?:here|the link)|limited (?:offer|slots?)|claim (?:now|your)|'
+        r'earn \$?\d+|100% (?:profit|legit)|send \d+ ?(?:btc|eth|usdt|ton))\b',
+        re.IGNORECASE
+    )
+    REPEAT_RE = re.compile(r'(.)\1{9,}')
+    MENTION_RE = re.compile(r'(?<!\w)@\w{4,}')
+    MONEY_RE = re.compile(r'\d\s*(?:%|\$|€|k\b|usdt?\b|btc\b|eth\b|ton\b)|[$€£]\s*\d', re.IGNORECASE)
+    CYRILLIC_RE = re.compile(r'[\u0400-\u04ff]')
+    LATIN_RE = re.compile(r'[a-zA-Z]')
+    EMOJI_RE = re.compile(r'[\U0001F300-\U0001FAFF\u2600-\u27BF]')
+    SHORTENERS = {'bit.ly', 'tinyurl.com', 'goo.gl', 'cutt.ly', 'is.gd', 't.ly', 'rebrand.ly', 'shorturl.at'}
+
+    def __init__(self, spam_threshold: float = SPAM_HEURISTIC_SPAM, ham_threshold: float = SPAM_HEURISTIC_HAM):
+        self.spam_threshold = spam_threshold
+        self.ham_threshold = ham_threshold
+        self.blocked_domains = set(SPAM_BLOCKED_DOMAINS)
+        if SPAM_BLOCKLIST_FILE and Path(SPAM_BLOCKLIST_FILE).exists():
+            for line in Path(SPAM_BLOCKLIST_FILE).read_text(encoding='utf-8').splitlines():
+                line = line.strip().lower()
+                if line and not line.startswith('#'):
+                    self.blocked_domains.add(line)
+        self.settled_spam = 0
+        self.settled_ham = 0
+        self.escalated = 0
+
+    def _domain_listed(self, host: str, domains: Set[str]) -> bool:
+        """Match host or any parent domain (sub.evil.com -> evil.com)"""
+        labels = host.lower().split('.')
+        return any('.'.join(labels[i:]) in domains for i in range(len(labels) - 1))
+
+    def score(self, text: str, sender_data: Dict) -> Tuple[float, List[str]]:
+        """Additive spam score with the indicators that fired"""
+        score = 0.0
+        reasons = []
+
+        hosts = [m.group(1) or m.group(2) for m in self.URL_RE.finditer(text)]
+        blocked = [h for h in hosts if self._domain_listed(h, self.blocked_domains)]
+        if blocked:
+            score += 0.9
+            reasons.append(f"blocked domain {blocked[0]}")
+        if any(self._domain_listed(h, self.SHORTENERS) for h in hosts):
+            score += 0.2
+            reasons.append("link shortener")
+        if len(hosts) >= 3:
+            score += 0.2
+            reasons.append(f"{len(hosts)} links")
+
+        invites = len(self.INVITE_RE.findall(text))
+        if invites:
+            score += min(0.3 * invites, 0.6)
+            reasons.append(f"{invites} invite link(s)")
+        if self.WALLET_RE.search(text):
+            score += 0.4
+            reasons.append("crypto wallet address")
+        scam_terms = {m.group().lower() for m in self.SCAM_RE.finditer(text)}
+        if scam_terms:
+            score += min(0.25 * len(scam_terms), 0.5)
+            reasons.append(f"scam phrasing ({', '.join(sorted(scam_terms)[:3])})")
+
+        # Character-class features
+        letters = [c for c in text if c.isalpha()]
+        if len(letters) >= 20 and sum(c.isupper() for c in letters) / len(letters) > 0.6:
+            score += 0.15
+            reasons.append("shouting caps")
+        if text and len(self.EMOJI_RE.findall(text)) / len(text) > 0.2:
+            score += 0.1
+            reasons.append("emoji flood")
+        if self.REPEAT_RE.search(text):
+            score += 0.15
+            reasons.append("repeated characters")
+        words = text.split()
+        if len(words) >= 12 and len(set(words)) / len(words) < 0.4:
+            score += 0.15
+            reasons.append("repeated words")
+        if any(self.CYRILLIC_RE.search(w) and self.LATIN_RE.search(w) for w in words):
+            score += 0.2
+            reasons.append("mixed-script words")
+
+        # Sender features
+        if sender_data.get('is_bot'):
+            score += 0.1
+            reasons.append("bot account")
+        if not sender_data.get('username'):
+            score += 0.1
+            reasons.append("no username")
+        if sender_data.get('has_photo') is False:
+            score += 0.05
+            reasons.append("no profile photo")
+        if (sender_data.get('id') or 0) > SPAM_NEW_ACCOUNT_ID:
+            score += 0.15
+            reasons.append("recent account")
+
+        return score, reasons
+
+    def is_plain_chat(self, text: str, sender_data: Dict) -> bool:
+        """Positive ham evidence: short, link/mention/money-free text from an established-looking sender"""
+        if (not sender_data.get('username') or sender_data.get('has_photo') is not True
+                or sender_data.get('is_bot') or (sender_data.get('id') or 0) > SPAM_NEW_ACCOUNT_ID):
+            return False
+        if len(text.split()) > SPAM_HAM_MAX_WORDS:
+            return False
+        return not (self.URL_RE.search(text) or self.INVITE_RE.search(text)
+                    or self.MENTION_RE.search(text) or self.MONEY_RE.search(text))
+
+    def settle(self, text: str, sender_data: Dict) -> Optional[Tuple[bool, float, str]]:
+        score, reasons = self.score(text, sender_data)
+        if score >= self.spam_threshold:
+            self.settled_spam += 1
+            return True, min(score, 1.0), "Heuristic: " + ", ".join(reasons)
+        if score <= self.ham_threshold and self.is_plain_chat(text, sender_data):
+            self.settled_ham += 1
+            return False, score, "Heuristic: short plain chat from an established sender"
+        self.escalated += 1
+        return None
+
+    def stats(self) -> Dict:
+        settled = self.settled_spam + self.settled_ham
+        total = settled + self.escalated
+        return {
+            'settled_spam': self.settled_spam,
+            'settled_ham': self.settled_ham,
+            'escalated': self.escalated,
+            'avoided_rate': settled / total if total else 0.0,
+            'blocked_domains': len(self.blocked_domains)
+        }
+
+
+class SchedulerOverloadedError(RuntimeError):
+    """Raised when a request is shed because its priority lane is full"""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute (burst = capacity)"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = float(self.capacity)
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self._updated = time.monotonic()
+
+    def set_rate(self, per_minute: float):
+        self._refill()
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self._refill()
+        self.tokens = 0.0
+
+
+class GeminiScheduler:
+    """
+    Single gate in front of the model: strict-priority lanes, a concurrency cap,
+    RPM/TPM token buckets, exponential backoff on 429/5xx and per-lane overflow
+    policy (defer or drop).
+    """
+
+    RETRYABLE_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, concurrency: int = GEMINI_CONCURRENCY, rpm: int = GEMINI_RPM, tpm: int = GEMINI_TPM,
+                 max_queue: int = GEMINI_MAX_QUEUE, max_retries: int = GEMINI_MAX_RETRIES):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.rpm_bucket = TokenBucket(rpm)
+        self.tpm_bucket = TokenBucket(tpm)
+        self._heap = []  # (priority, seq, tokens, future)
+        self._seq = 0
+        self._running = 0
+        self._pump_handle = None
+        self._space = asyncio.Condition()
+        self.depth = Counter()
+        self.completed = Counter()
+        self.dropped = Counter()
+        self.retries = 0
+        self.wait_total = defaultdict(float)
+        self.wait_max = defaultdict(float)
+
+    async def run(self, fn, *args, priority: int = PRIORITY_INTERACTIVE, tokens: int = 1):
+        """Run a blocking model call in a worker thread once the scheduler grants it a slot"""
+        enqueued = time.monotonic()
+        attempt = 0
+        while True:
+            await self._acquire(priority, tokens)
+            if attempt == 0:
+                waited = time.monotonic() - enqueued
+                self.wait_total[priority] += waited
+                self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+            try:
+                result = await asyncio.to_thread(fn, *args)
+                self.completed[priority] += 1
+                return result
+            except Exception as e:
+                if getattr(e, 'code', None) not in self.RETRYABLE_CODES or attempt >= self.max_retries:
+                    raise
+                if getattr(e, 'code', None) == 429:
+                    # Quota hit: stop everyone else from piling on too
+                    self.rpm_bucket.drain()
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                logger.warning(f"Gemini call failed ({e}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                self.retries += 1
+                attempt += 1
+            finally:
+                self._release()
+
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, priority: int, tokens: int):
+        if self.depth[priority] >= self.max_queue:
+            if GEMINI_OVERFLOW_POLICY.get(priority) == 'drop':
+                self.dropped[priority] += 1
+                raise SchedulerOverloadedError(f"{PRIORITY_NAMES.get(priority, priority)} queue full, request dropped")
+            async with self._space:
+                await self._space.wait_for(lambda: self.depth[priority] < self.max_queue)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, self._seq, tokens, future))
+        self._seq += 1
+        self.depth[priority] += 1
+        self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled after _pump granted the slot but before we resumed: hand it back
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self._running -= 1
+        self._pump()
+
+    def _pump(self):
+        """Grant slots to queued requests in priority order while capacity and rate budget allow"""
+        if self._pump_handle:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+
+        granted = False
+        while self._heap and self._running < self.concurrency:
+            priority, _, tokens, future = self._heap[0]
+            wait = max(self.rpm_bucket.wait_time(1), self.tpm_bucket.wait_time(tokens))
+            if wait > 0:
+                self._pump_handle = asyncio.get_running_loop().call_later(wait, self._pump)
+                break
+            heapq.heappop(self._heap)
+            self.depth[priority] -= 1
+            if future.done():
+                continue
+            self.rpm_bucket.take(1)
+            self.tpm_bucket.take(tokens)
+            self._running += 1
+            future.set_result(None)
+            granted = True
+
+        if granted:
+            asyncio.get_running_loop().create_task(self._notify_space())
+
+    async def _notify_space(self):
+        async with self._space:
+            self._space.notify_all()
+
+    def stats(self) -> Dict:
+        lanes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            done = self.completed[priority]
+            lanes[name] = {
+                'queued': self.depth[priority],
+                'completed': done,
+                'dropped': self.dropped[priority],
+                'avg_wait': self.wait_total[priority] / done if done else 0.0,
+                'max_wait': self.wait_max[priority]
+            }
+        return {'running': self._running, 'concurrency': self.concurrency, 'retries': self.retries, 'lanes': lanes}
+
+
 class IntelligenceUnit:
     def __init__(self, api_key):
         genai.configure(api_key=api_key)
+        self.model_name = os.getenv("GEMINI_MODEL", "gemini-3-pro")
+        self.system_instruction = (
+            "You are ATLAS, an elite intelligence analyst for a top-tier tech firm. "
+            "Your source material comes from raw Telegram thread dumps. "
+            "Your goal is to extract critical insights, sentiment, and action items. "
+            "Ignore spam. Focus on signal. Output structured, executive-level summaries. "
+            "Extract entities: people, organizations, locations, dates, keywords. "
+            "Provide sentiment analysis with scores. Identify threats, opportunities, and trends."
+        )
         self.model = genai.GenerativeModel(
-            model_name=os.getenv("GEMINI_MODEL", "gemini-3-pro"),
-            system_instruction=(
-                "You are ATLAS, an elite intelligence analyst for a top-tier tech firm. "
-                "Your source material comes from raw Telegram thread dumps. "
-                "Your goal is to extract critical insights, sentiment, and action items. "
-                "Ignore spam. Focus on signal. Output structured, executive-level summaries. "
-                "Extract entities: people, organizations, locations, dates, keywords. "
-                "Provide sentiment analysis with scores. Identify threats, opportunities, and trends."
-            )
+            model_name=self.model_name,
+            system_instruction=self.system_instruction
         )
+        self.cache = ResponseCache() if LLM_CACHE_ENABLED else None
+        self.scheduler = GeminiScheduler()
+        self.spam_filter = SpamHeuristics() if SPAM_HEURISTICS_ENABLED else None
 
-    async def analyze_content(self, context_data, custom_prompt=None, extract_entities=False):
+    async def _generate(self, prompt: str, media=None, use_cache=True, priority=PRIORITY_INTERACTIVE) -> str:
+        """
+        Run one model call through the response cache and the request scheduler.
+        `media` is optional inline data ({"mime_type", "data"}) or a file path to upload.
+        """
+        key = None
+        if use_cache and self.cache:
+            content_hash = ''
+            if isinstance(media, dict):
+                content_hash = media['mime_type'] + ':' + ResponseCache.hash_payload(media['data'])
+            elif media is not None:
+                content_hash = await asyncio.to_thread(ResponseCache.hash_payload, media)
+            key = ResponseCache.make_key(self.model_name, self.system_instruction, prompt, content_hash)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+
+        if media is None:
+            contents = prompt
+        elif isinstance(media, dict):
+            contents = [media, prompt]
+        else:
+            contents = [await asyncio.to_thread(genai.upload_file, media), prompt]
+
+        # Media parts are budgeted at a flat estimate on top of the prompt
+        est_tokens = len(prompt) // CHARS_PER_TOKEN + (1000 if media is not None else 0)
+        response = await self.scheduler.run(self.model.generate_content, contents, priority=priority, tokens=est_tokens)
+        text = response.text
+
+        if key:
+            await asyncio.to_thread(self.cache.put, key, text)
+        return text
+
+    async def analyze_content(self, context_data, custom_prompt=None, extract_entities=False, use_cache=True,
+                              priority=PRIORITY_INTERACTIVE):
         try:
             base_prompt = (
                 "Analyze the following Telegram chat history. "
@@ -69,38 +706,74 @@ class IntelligenceUnit:
                 base_prompt += "\n\nIMPORTANT: At the end, provide a structured entity list in this format:\n"
                 base_prompt += "=== ENTITIES ===\nPeople: [list]\nOrganizations: [list]\nLocations: [list]\nKeywords: [list]\nDates: [list]\nSentiment Score: [0-100]"
 
-            final_prompt = f"{custom_prompt if custom_prompt else base_prompt}\n\n--- LOG START ---\n{context_data}\n--- LOG END ---"
+            task_prompt = custom_prompt if custom_prompt else base_prompt
+            context_data, condensed = await self._condense(context_data, task_prompt, ANALYSIS_CHUNK_TOKENS, use_cache, priority)
 
-            response = await asyncio.to_thread(
-                self.model.generate_content, final_prompt
-            )
-            return response.text
+            if condensed:
+                final_prompt = (
+                    f"{task_prompt}\n\nThe log was too large for a single pass; below are chronological "
+                    f"summaries of its parts.\n\n--- SUMMARIES START ---\n{context_data}\n--- SUMMARIES END ---"
+                )
+            else:
+                final_prompt = f"{task_prompt}\n\n--- LOG START ---\n{context_data}\n--- LOG END ---"
+
+            return await self._generate(final_prompt, use_cache=use_cache, priority=priority)
         except Exception as e:
             logger.error(f"AI Analysis Failed: {e}")
             return f"⚠️ **Intelligence Failure:** {str(e)}"
 
-    async def analyze_media(self, media_path, media_type="image"):
-        """Analyze images, videos, or documents using Gemini's multimodal capabilities"""
+    async def analyze_media(self, media, media_type="image", mime_type=None, use_cache=True,
+                            priority=PRIORITY_INTERACTIVE):
+        """
+        Analyze images, videos, or documents using Gemini's multimodal capabilities.
+        `media` is either raw bytes (sent inline with mime_type) or a file path (uploaded).
+        """
         try:
-            media_file = genai.upload_file(media_path)
+            if isinstance(media, bytes):
+                media = {"mime_type": mime_type or "application/octet-stream", "data": media}
 
             prompt = f"Analyze this {media_type} from a Telegram chat. Extract any text (OCR), describe the content, identify key information, and assess relevance for intelligence purposes."
 
-            response = await asyncio.to_thread(
-                self.model.generate_content, [media_file, prompt]
-            )
-
-            return response.text
+            return await self._generate(prompt, media, use_cache=use_cache, priority=priority)
         except Exception as e:
             logger.error(f"Media Analysis Failed: {e}")
             return f"⚠️ **Media Analysis Failure:** {str(e)}"
 
-    async def compare_channels(self, channel_data_list: List[Tuple[str, str]]):
+    async def fold_summary(self, running_summary: str, delta_report: str, use_cache=True,
+                           priority=PRIORITY_REPORT) -> str:
+        """Merge a report on new activity into a chat's running summary"""
+        try:
+            prompt = f"""You maintain a running intelligence summary of a Telegram chat.
+
+CURRENT RUNNING SUMMARY:
+{running_summary}
+
+REPORT ON NEW ACTIVITY:
+{delta_report}
+
+Rewrite the running summary to incorporate the new activity. Keep ongoing threads, update facts that
+changed, drop details that are no longer relevant, and stay under {ROLLING_SUMMARY_WORDS} words.
+"""
+            return await self._generate(prompt, use_cache=use_cache, priority=priority)
+        except Exception as e:
+            logger.error(f"Summary fold failed: {e}")
+            return f"⚠️ **Intelligence Failure:** {str(e)}"
+
+    async def compare_channels(self, channel_data_list: List[Tuple[str, str]], use_cache=True,
+                               priority=PRIORITY_INTERACTIVE):
         """Compare multiple channels and identify patterns, differences, and relationships"""
         try:
             comparison_prompt = "You are analyzing multiple Telegram channels. Compare and contrast them:\n\n"
 
-            for i, (channel_name, data) in enumerate(channel_data_list, 1):
+            # Channels share one prompt, so each gets an equal slice of the budget
+            channel_budget = ANALYSIS_CHUNK_TOKENS // max(len(channel_data_list), 1)
+            condensed = await asyncio.gather(*(
+                self._condense(data, f"Summarize channel {channel_name} for a cross-channel comparison.",
+                               channel_budget, use_cache, priority)
+                for channel_name, data in channel_data_list
+            ))
+
+            for i, ((channel_name, _), (data, _)) in enumerate(zip(channel_data_list, condensed), 1):
                 comparison_prompt += f"=== CHANNEL {i}: {channel_name} ===\n{data}\n\n"
 
             comparison_prompt += "\n\nProvide a comparative analysis highlighting:\n"
@@ -110,67 +783,636 @@ class IntelligenceUnit:
             comparison_prompt += "4. Coordination or conflicts between channels\n"
             comparison_prompt += "5. Strategic recommendations"
 
-            response = await asyncio.to_thread(
-                self.model.generate_content, comparison_prompt
-            )
-            return response.text
+            return await self._generate(comparison_prompt, use_cache=use_cache, priority=priority)
         except Exception as e:
             logger.error(f"Channel Comparison Failed: {e}")
             return f"⚠️ **Comparison Failure:** {str(e)}"
 
-    async def detect_spam_bot(self, message_text: str, sender_data: Dict) -> Tuple[bool, float, str]:
+    @staticmethod
+    def _split_chunks(text: str, max_tokens: int) -> List[str]:
+        """Split text on line boundaries into chunks of at most max_tokens (estimated)"""
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return [text]
+
+        chunks = []
+        current = []
+        current_len = 0
+        for line in text.split('\n'):
+            # A single oversized line is hard-split
+            while len(line) > max_chars:
+                if current:
+                    chunks.append('\n'.join(current))
+                    current, current_len = [], 0
+                chunks.append(line[:max_chars])
+                line = line[max_chars:]
+            if current_len + len(line) + 1 > max_chars and current:
+                chunks.append('\n'.join(current))
+                current, current_len = [], 0
+            current.append(line)
+            current_len += len(line) + 1
+
+        if current:
+            chunks.append('\n'.join(current))
+        return chunks
+
+    async def _condense(self, text: str, task_prompt: str, max_tokens: int, use_cache=True,
+                        priority=PRIORITY_INTERACTIVE, depth: int = 0) -> Tuple[str, bool]:
+        """
+        Map-reduce a text that exceeds max_tokens: summarize token-budgeted chunks
+        concurrently, then merge the partial summaries, repeating if the merged
+        summaries are still too large. Returns (text, condensed).
+        """
+        chunks = self._split_chunks(text, max_tokens)
+        if len(chunks) == 1:
+            return text, False
+
+        logger.info(f"Map-reduce analysis: {len(chunks)} chunks (~{len(text) // CHARS_PER_TOKEN} tokens, pass {depth + 1})")
+        semaphore = asyncio.Semaphore(ANALYSIS_MAP_CONCURRENCY)
+
+        async def summarize(index, chunk):
+            map_prompt = (
+                f"You are condensing part {index} of {len(chunks)} of a Telegram chat history. "
+                f"The final analysis will address this task:\n{task_prompt}\n\n"
+                "Write a dense, chronological summary of this part that preserves everything the task needs: "
+                "topics, decisions, dates and deadlines, names, organizations, locations, notable quotes and sentiment.\n\n"
+                f"--- PART START ---\n{chunk}\n--- PART END ---"
+            )
+            async with semaphore:
+                summary = await self._generate(map_prompt, use_cache=use_cache, priority=priority)
+            return f"=== PART {index}/{len(chunks)} ===\n{summary}"
+
+        summaries = await asyncio.gather(*(summarize(i, chunk) for i, chunk in enumerate(chunks, 1)))
+        merged = "\n\n".join(summaries)
+
+        # Very long histories can still overflow after one pass
+        if depth < 2 and len(merged) < len(text):
+            merged, _ = await self._condense(merged, task_prompt, max_tokens, use_cache, priority, depth + 1)
+        return merged, True
+
+    async def detect_spam_bot(self, message_text: str, sender_data: Dict, use_cache=True,
+                              priority=PRIORITY_INTERACTIVE) -> Tuple[bool, float, str]:
         """
         ML-powered spam/bot detection
         Returns: (is_spam, confidence_score, reason)
         """
+        verdicts = await self.detect_spam_batch([(message_text, sender_data)], use_cache=use_cache, priority=priority)
+        return verdicts[0]
+
+    async def detect_spam_batch(self, items: List[Tuple[str, Dict]], use_cache=True, priority=PRIORITY_INTERACTIVE,
+                                batch_size: int = SPAM_BATCH_SIZE, prefilter=True) -> List[Tuple[bool, float, str]]:
+        """
+        Classify many (message_text, sender_data) pairs, `batch_size` per model call.
+        Clear cases are settled by the local pre-filter (unless `prefilter` is off); the rest are batched
+        concurrently. Verdicts come back in input order.
+        """
+        verdicts = [self.prefilter_spam(text, sender_data) if prefilter else None for text, sender_data in items]
+        ambiguous = [i for i, verdict in enumerate(verdicts) if verdict is None]
+
+        batches = [ambiguous[i:i + batch_size] for i in range(0, len(ambiguous), batch_size)]
+        results = await asyncio.gather(*(
+            self._classify_spam_batch([items[i] for i in batch], use_cache, priority) for batch in batches
+        ))
+        for batch, batch_verdicts in zip(batches, results):
+            for i, verdict in zip(batch, batch_verdicts):
+                verdicts[i] = verdict
+        return verdicts
+
+    def prefilter_spam(self, message_text: str, sender_data: Dict) -> Optional[Tuple[bool, float, str]]:
+        """Local verdict for clear spam/ham, or None when the model should decide"""
+        return self.spam_filter.settle(message_text, sender_data) if self.spam_filter else None
+
+    async def _classify_spam_batch(self, batch: List[Tuple[str, Dict]], use_cache,
+                                   priority) -> List[Tuple[bool, float, str]]:
+        entries = [
+            {'id': i, 'message': text[:SPAM_TEXT_MAX_CHARS], 'sender': sender_data}
+            for i, (text, sender_data) in enumerate(batch)
+        ]
+        detection_prompt = f"""You are a spam and bot detection system for Telegram.
+
+Analyze each message below together with its sender data. Look for suspicious links,
+repetitive text, bot-like patterns and scam keywords.
+
+Messages (JSON):
+{json.dumps(entries, default=str, ensure_ascii=False)}
+
+Respond with ONLY a JSON array containing one object per message, in this format:
+[{{"id": 0, "spam": true, "confidence": 0-100, "reason": "brief explanation"}}]
+"""
         try:
-            detection_prompt = f"""You are a spam and bot detection system for Telegram.
+            response_text = await self._generate(detection_prompt, use_cache=use_cache, priority=priority)
+            verdicts = self._parse_spam_verdicts(response_text)
+        except Exception as e:
+            logger.error(f"Spam detection failed: {e}")
+            return [(False, 0.0, str(e))] * len(batch)
 
-Analyze this message and sender data:
+        return [verdicts.get(i, (False, 0.0, "No verdict returned")) for i in range(len(batch))]
 
-Message: {message_text}
-Sender Info: {json.dumps(sender_data, default=str)}
+    @staticmethod
+    def _parse_spam_verdicts(response_text: str) -> Dict[int, Tuple[bool, float, str]]:
+        """Map message index -> verdict from the model's JSON array (tolerates code fences)"""
+        match = re.search(r'\[.*\]', response_text, re.DOTALL)
+        if not match:
+            raise ValueError("No JSON verdicts in model response")
+
+        verdicts = {}
+        for item in json.loads(match.group()):
+            try:
+                confidence = float(item.get('confidence', 50))
+                verdicts[int(item['id'])] = (
+                    bool(item.get('spam')),
+                    max(0.0, min(confidence, 100.0)) / 100.0,
+                    str(item.get('reason') or "Suspicious patterns detected")
+                )
+            except:
+                continue
+        return verdicts
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate clustering over recent messages.
+    MinHash signatures of character 4-grams with banded LSH (8 bands x 4 rows),
+    verified by estimated Jaccard similarity, over a bounded (count + TTL) window.
+    Spam verdicts confirmed for one member apply to the whole cluster.
+    """
+
+    BUCKET_CAP = 32  # Most recent signatures checked per bucket
+    BANDS = 8
+    ROWS = 4
+    MASK = (1 << 64) - 1
+
+    def __init__(self, max_entries: int = DUP_WINDOW_SIZE, ttl: int = DUP_WINDOW_TTL,
+                 min_similarity: float = DUP_MIN_SIMILARITY, min_chars: int = DUP_MIN_CHARS,
+                 min_confidence: float = AUTOMOD_BAN_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.min_chars = min_chars
+        self.min_confidence = min_confidence
+        # Fixed seed so signatures are comparable across restarts
+        rng = random.Random(0x5eed)
+        self._permutations = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(self.BANDS * self.ROWS)]
+        self._entries = OrderedDict()  # (chat_id, msg_id) -> (signature, cluster_id, added)
+        self._buckets = {}  # (band, rows) -> deque of entry keys
+        self._clusters = {}  # cluster_id -> {'size', 'verdict'}
+        self._next_cluster = 0
+        self.propagated = 0
 
-Determine:
-1. Is this likely spam? (yes/no)
-2. Confidence score (0-100)
-3. Specific indicators (e.g., suspicious links, repetitive text, bot-like patterns, scam keywords)
+    @staticmethod
+    def _normalize(text: str) -> str:
+        text = unicodedata.normalize('NFKC', text).casefold()
+        text = re.sub(r'\d', '0', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        text = self._normalize(text)
+        hashes = [
+            int.from_bytes(hashlib.blake2b(text[i:i + 4].encode('utf-8'), digest_size=8).digest(), 'big')
+            for i in range(max(1, len(text) - 3))
+        ]
+        mask = self.MASK
+        return tuple(min((h * a + b) & mask for h in hashes) for a, b in self._permutations)
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        return [(band, signature[band * self.ROWS:(band + 1) * self.ROWS]) for band in range(self.BANDS)]
+
+    def observe(self, chat_id: int, msg_id: int, text: str) -> Optional[int]:
+        """Add a message to the window and return its cluster id (None if too short to judge)"""
+        key = (chat_id, msg_id)
+        if key in self._entries:
+            return self._entries[key][1]
+        if len(text.strip()) < self.min_chars:
+            return None
+
+        self._evict()
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+
+        best_cluster, best_similarity = None, self.min_similarity
+        seen = set()
+        for band_key in band_keys:
+            for other in self._buckets.get(band_key, ()):
+                entry = self._entries.get(other)
+                if entry is None or other in seen:
+                    continue
+                seen.add(other)
+                similarity = sum(x == y for x, y in zip(signature, entry[0])) / len(signature)
+                if similarity >= best_similarity:
+                    best_cluster, best_similarity = entry[1], similarity
+
+        if best_cluster is None:
+            best_cluster = self._next_cluster
+            self._next_cluster += 1
+            self._clusters[best_cluster] = {'size': 0, 'verdict': None}
+        self._clusters[best_cluster]['size'] += 1
+
+        self._entries[key] = (signature, best_cluster, time.monotonic())
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, deque(maxlen=self.BUCKET_CAP)).append(key)
+        return best_cluster
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            key, (signature, cluster_id, added) = next(iter(self._entries.items()))
+            if len(self._entries) < self.max_entries and added >= cutoff:
+                break
+            del self._entries[key]
+            for band_key in self._band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if bucket is not None:
+                    try:
+                        bucket.remove(key)
+                    except ValueError:
+                        pass
+                    if not bucket:
+                        del self._buckets[band_key]
+            cluster = self._clusters[cluster_id]
+            cluster['size'] -= 1
+            if cluster['size'] <= 0:
+                del self._clusters[cluster_id]
+
+    def verdict(self, cluster_id: Optional[int]) -> Optional[Tuple[bool, float, str]]:
+        """Confirmed spam verdict shared by this cluster, if any"""
+        cluster = self._clusters.get(cluster_id)
+        if cluster and cluster['verdict']:
+            self.propagated += 1
+            is_spam, confidence, reason = cluster['verdict']
+            return is_spam, confidence, f"Near-duplicate of confirmed spam ({reason})"
+        return None
+
+    def confirm(self, cluster_id: Optional[int], verdict: Tuple[bool, float, str]):
+        """Record a spam verdict for the cluster; clean or low-confidence verdicts are not propagated"""
+        cluster = self._clusters.get(cluster_id)
+        if cluster and verdict[0] and verdict[1] >= self.min_confidence and not cluster['verdict']:
+            cluster['verdict'] = verdict
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'clusters': len(self._clusters),
+            'spam_clusters': sum(1 for c in self._clusters.values() if c['verdict']),
+            'largest': max((c['size'] for c in self._clusters.values()), default=0),
+            'propagated': self.propagated
+        }
+
+
+class SpamMicroBatcher:
+    """
+    Collects spam checks arriving within a short window and classifies them
+    in one model call. `classify` resolves to that message's verdict.
+    Near-duplicates of confirmed spam are settled from the cluster, and
+    variants of a message already in flight share its model call.
+    """
+
+    def __init__(self, ai: IntelligenceUnit, dup_index: Optional[NearDuplicateIndex] = None,
+                 window: float = AUTOMOD_BATCH_WINDOW, max_batch: int = SPAM_BATCH_SIZE,
+                 priority: int = PRIORITY_AUTOMOD):
+        self.ai = ai
+        self.dup_index = dup_index
+        self.window = window
+        self.max_batch = max_batch
+        self.priority = priority
+        self._pending = []  # (item, future)
+        self._inflight = {}  # cluster_id -> future of the representative message
+        self._batches = set()  # Running _run tasks, held so they aren't garbage-collected
+        self._timer = None
+
+    async def classify(self, message_text: str, sender_data: Dict, chat_id: int = 0,
+                       msg_id: int = 0) -> Tuple[bool, float, str]:
+        verdict, _ = await self.classify_with_source(message_text, sender_data, chat_id, msg_id)
+        return verdict
+
+    async def classify_with_source(self, message_text: str, sender_data: Dict, chat_id: int = 0,
+                                   msg_id: int = 0) -> Tuple[Tuple[bool, float, str], str]:
+        """Like classify(), plus where the verdict came from: 'cluster', 'heuristic', 'shared' or 'model'"""
+        cluster_id = self.dup_index.observe(chat_id, msg_id, message_text) if self.dup_index else None
+        verdict = self.dup_index.verdict(cluster_id) if cluster_id is not None else None
+        if verdict is not None:
+            return verdict, 'cluster'
+
+        source = 'heuristic'
+        verdict = self.ai.prefilter_spam(message_text, sender_data)
+        if verdict is None and cluster_id is not None and cluster_id in self._inflight:
+            # Share a variant's pending result only if it is confident spam, as confirm() would
+            shared = await asyncio.shield(self._inflight[cluster_id])
+            if shared[0] and shared[1] >= self.dup_index.min_confidence:
+                verdict, source = shared, 'shared'
+        if verdict is None:
+            verdict, source = await self._enqueue(message_text, sender_data, cluster_id), 'model'
+
+        if cluster_id is not None:
+            self.dup_index.confirm(cluster_id, verdict)
+        return verdict, source
+
+    async def _enqueue(self, message_text: str, sender_data: Dict, cluster_id: Optional[int]):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((message_text, sender_data), future))
+        if cluster_id is not None:
+            self._inflight[cluster_id] = future
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
 
-Response format:
-SPAM: [yes/no]
-CONFIDENCE: [0-100]
-REASON: [brief explanation]
-"""
+        try:
+            return await future
+        finally:
+            if cluster_id is not None and self._inflight.get(cluster_id) is future:
+                del self._inflight[cluster_id]
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            batch = asyncio.create_task(self._run(pending))
+            self._batches.add(batch)
+            batch.add_done_callback(self._batches.discard)
+
+    async def _run(self, pending):
+        # Already pre-filtered in classify()
+        verdicts = await self.ai.detect_spam_batch(
+            [item for item, _ in pending], priority=self.priority, prefilter=False
+        )
+        for (_, future), verdict in zip(pending, verdicts):
+            if not future.done():
+                future.set_result(verdict)
+
+
+# --- MEDIA PIPELINE MODULE ---
+class MediaAnalysisCache:
+    """
+    Persistent cache of media analyses.
+    Analyses are stored once per content hash (SHA-256 of the file bytes);
+    Telegram file ids (id + access hash) point at a content hash so reposts of
+    the same file hit without being downloaded again.
+    """
+
+    def __init__(self, db_path: Path = MEDIA_CACHE_DB_PATH, max_entries: int = MEDIA_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.file_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                content_hash TEXT PRIMARY KEY,
+                media_type TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_analyses_last_used ON analyses (last_used);
+            CREATE TABLE IF NOT EXISTS file_ids (
+                file_key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
 
-            response = await asyncio.to_thread(
-                self.model.generate_content, detection_prompt
+    @staticmethod
+    def file_key(msg) -> Optional[str]:
+        """Stable Telegram id for a message's photo or document"""
+        media = msg.photo or msg.document
+        if media is None:
+            return None
+        kind = 'photo' if msg.photo else 'document'
+        return f"{kind}:{media.id}:{media.access_hash}"
+
+    def lookup_file(self, file_key: str) -> Optional[Tuple[str, str]]:
+        """Return (media_type, analysis) for a known Telegram file id"""
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT a.content_hash, a.media_type, a.analysis FROM file_ids f "
+                "JOIN analyses a ON a.content_hash = f.content_hash WHERE f.file_key = ?",
+                (file_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE analyses SET last_used = ? WHERE content_hash = ?", (int(time.time()), row[0]))
+        self.file_hits += 1
+        return row[1], row[2]
+
+    def lookup_content(self, content_hash: str, file_key: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """Return (media_type, analysis) for known file bytes, linking file_key to them on a hit"""
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT media_type, analysis FROM analyses WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE analyses SET last_used = ? WHERE content_hash = ?", (int(time.time()), content_hash))
+            if file_key:
+                self.conn.execute("INSERT OR REPLACE INTO file_ids (file_key, content_hash) VALUES (?, ?)", (file_key, content_hash))
+        self.content_hits += 1
+        return row[0], row[1]
+
+    def store(self, content_hash: str, file_key: Optional[str], media_type: str, analysis: str):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analyses (content_hash, media_type, analysis, last_used) VALUES (?, ?, ?, ?)",
+                (content_hash, media_type, analysis, int(time.time()))
             )
+            if file_key:
+                self.conn.execute("INSERT OR REPLACE INTO file_ids (file_key, content_hash) VALUES (?, ?)", (file_key, content_hash))
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used analyses beyond max_entries (caller holds the lock)"""
+        count = self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self.conn.execute(
+            "DELETE FROM analyses WHERE content_hash IN "
+            "(SELECT content_hash FROM analyses ORDER BY last_used ASC LIMIT ?)",
+            (count - self.max_entries,)
+        )
+        self.conn.execute("DELETE FROM file_ids WHERE content_hash NOT IN (SELECT content_hash FROM analyses)")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'file_hits': self.file_hits,
+            'content_hits': self.content_hits,
+            'misses': self.misses,
+            'saved_calls': self.file_hits + self.content_hits,
+            'saved_downloads': self.file_hits
+        }
+
+
+class MediaPipeline:
+    """
+    Producer/consumer pipeline for media analysis.
+    The message scan submits media messages; a pool of download workers feeds a
+    pool of analysis workers through bounded queues, and results come back in
+    submission order. Cached analyses short-circuit both stages.
+    """
+
+    def __init__(self, ai: IntelligenceUnit, cache: Optional[MediaAnalysisCache] = None,
+                 download_workers: int = MEDIA_DOWNLOAD_WORKERS, analysis_workers: int = MEDIA_ANALYSIS_WORKERS):
+        self.ai = ai
+        self.cache = cache
+        self._download_queue = asyncio.Queue(maxsize=download_workers * 2)
+        self._analysis_queue = asyncio.Queue(maxsize=analysis_workers * 2)
+        self._results = {}  # submission seq -> formatted analysis line
+        self._next_seq = 0
+        self._stage_time = defaultdict(float)
+        self._stage_count = Counter()
+        self._started = time.monotonic()
+        self._download_workers = [asyncio.create_task(self._download_worker()) for _ in range(download_workers)]
+        self._analysis_workers = [asyncio.create_task(self._analysis_worker()) for _ in range(analysis_workers)]
+
+    async def submit(self, msg, timestamp: str):
+        """Queue a message for download and analysis; blocks only when the download queue is full"""
+        await self._download_queue.put((self._next_seq, msg, timestamp, time.monotonic()))
+        self._next_seq += 1
+
+    async def finish(self) -> List[str]:
+        """Drain both stages and return analysis lines in submission order"""
+        for _ in self._download_workers:
+            await self._download_queue.put(None)
+        await asyncio.gather(*self._download_workers)
+
+        for _ in self._analysis_workers:
+            await self._analysis_queue.put(None)
+        await asyncio.gather(*self._analysis_workers)
+
+        self._log_timings()
+        return [self._results[seq] for seq in sorted(self._results)]
+
+    def cancel(self):
+        for task in self._download_workers + self._analysis_workers:
+            task.cancel()
+
+    async def _download_worker(self):
+        while True:
+            item = await self._download_queue.get()
+            if item is None:
+                return
+            seq, msg, timestamp, submitted = item
+            self._record('queue', submitted)
+
+            # Known file id: skip the download and the model call
+            file_key = MediaAnalysisCache.file_key(msg) if self.cache else None
+            if file_key:
+                cached = await asyncio.to_thread(self.cache.lookup_file, file_key)
+                if cached:
+                    self._results[seq] = self._format(timestamp, *cached)
+                    continue
+
+            started = time.monotonic()
+            try:
+                downloaded = await self._download(msg)
+            except Exception as e:
+                logger.warning(f"Media download skipped for message {msg.id}: {e}")
+                downloaded = None
+            self._record('download', started)
+            if not downloaded:
+                continue
 
-            result_text = response.text.upper()
-            is_spam = 'SPAM: YES' in result_text
+            # Same bytes seen under another file id: skip the model call
+            payload, media_type, mime_type = downloaded
+            content_hash = None
+            if self.cache:
+                content_hash = await asyncio.to_thread(ResponseCache.hash_payload, payload)
+                cached = await asyncio.to_thread(self.cache.lookup_content, content_hash, file_key)
+                if cached:
+                    self._results[seq] = self._format(timestamp, *cached)
+                    self._discard(payload)
+                    continue
 
-            # Extract confidence score
-            confidence = 0.0
-            if 'CONFIDENCE:' in result_text:
-                try:
-                    conf_line = [line for line in result_text.split('\n') if 'CONFIDENCE:' in line][0]
-                    confidence = float(re.search(r'\d+', conf_line).group()) / 100.0
-                except:
-                    confidence = 0.5
+            await self._analysis_queue.put((seq, msg.id, timestamp, payload, media_type, mime_type, content_hash, file_key))
 
-            # Extract reason
-            reason = "Suspicious patterns detected"
-            if 'REASON:' in response.text:
-                try:
-                    reason = response.text.split('REASON:')[1].strip().split('\n')[0]
-                except:
-                    pass
+    async def _analysis_worker(self):
+        while True:
+            item = await self._analysis_queue.get()
+            if item is None:
+                return
+            seq, msg_id, timestamp, payload, media_type, mime_type, content_hash, file_key = item
+
+            started = time.monotonic()
+            try:
+                analysis = await self.ai.analyze_media(payload, media_type, mime_type)
+                self._results[seq] = self._format(timestamp, media_type, analysis)
+                if content_hash and not analysis.startswith("⚠️"):
+                    await asyncio.to_thread(self.cache.store, content_hash, file_key, media_type, analysis)
+            except Exception as e:
+                logger.warning(f"Media analysis skipped for message {msg_id}: {e}")
+            finally:
+                self._discard(payload)
+            self._record('analysis', started)
+
+    async def _download(self, msg) -> Optional[Tuple[object, str, str]]:
+        """
+        Download a message's media. Returns (payload, media_type, mime_type) or None,
+        where payload is bytes for files up to MEDIA_INLINE_MAX_BYTES and a temp
+        file path above that.
+        """
+        if isinstance(msg.media, MessageMediaPhoto):
+            media_type = "image"
+            mime_type = "image/jpeg"
+        elif isinstance(msg.media, MessageMediaDocument):
+            # Handle documents/videos/voice
+            file_ext = (msg.file.ext or '').lower()
+            if file_ext in ['.mp4', '.avi', '.mov']:
+                media_type = "video"
+            elif file_ext in ['.ogg', '.mp3', '.wav', '.m4a']:
+                media_type = "audio/voice message"
+            else:
+                media_type = "document"
+            mime_type = msg.file.mime_type
+        else:
+            return None
 
-            return is_spam, confidence, reason
+        if (msg.file.size or 0) <= MEDIA_INLINE_MAX_BYTES:
+            payload = await msg.download_media(file=bytes)
+            return (payload, media_type, mime_type) if payload else None
 
-        except Exception as e:
-            logger.error(f"Spam detection failed: {e}")
-            return False, 0.0, str(e)
+        fd, temp_path = tempfile.mkstemp(prefix=f"atlas_media_{msg.id}_", suffix=msg.file.ext or '')
+        os.close(fd)
+        try:
+            path = await msg.download_media(file=temp_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        if not path:
+            os.remove(temp_path)
+            return None
+        return path, media_type, mime_type
+
+    @staticmethod
+    def _discard(payload):
+        """Remove a spilled temp file; in-memory payloads need no cleanup"""
+        if isinstance(payload, str) and os.path.exists(payload):
+            os.remove(payload)
+
+    @staticmethod
+    def _format(timestamp: str, media_type: str, analysis: str) -> str:
+        label = "📷 Photo" if media_type == "image" else f"📎 {media_type.title()}"
+        return f"[{timestamp}] {label} Analysis: {analysis}"
+
+    def _record(self, stage: str, started: float):
+        self._stage_time[stage] += time.monotonic() - started
+        self._stage_count[stage] += 1
+
+    def _log_timings(self):
+        wall = time.monotonic() - self._started
+        parts = []
+        for stage in ('queue', 'download', 'analysis'):
+            count = self._stage_count[stage]
+            total = self._stage_time[stage]
+            parts.append(f"{stage} {total:.1f}s total / {total / count if count else 0:.2f}s avg")
+        logger.info(f"Media pipeline: {len(self._results)}/{self._next_seq} analyzed in {wall:.1f}s wall ({'; '.join(parts)})")
 
 
 # --- EXPORT MODULE ---
@@ -203,20 +1445,1195 @@ class ExportHandler:
         return filepath
 
 
+class RawMessageWriter:
+    """Streams message records to a JSON or CSV export file batch by batch"""
+
+    CSV_FIELDS = ['timestamp', 'sender_name', 'sender_username', 'message']
+
+    def __init__(self, filename: str, export_format: str = 'json'):
+        self.export_format = 'json' if export_format == 'json' else 'csv'
+        self.filepath = EXPORTS_DIR / f"{filename}.{self.export_format}"
+        self.count = 0
+        self._file = open(self.filepath, 'w', newline='', encoding='utf-8')
+
+        if self.export_format == 'json':
+            self._file.write('{"messages": [')
+        else:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.CSV_FIELDS)
+            self._writer.writeheader()
+
+    def write_batch(self, records: List[Dict]):
+        for record in records:
+            if self.export_format == 'json':
+                self._file.write((',\n' if self.count else '\n') + json.dumps(record, ensure_ascii=False, default=str))
+            else:
+                self._writer.writerow({
+                    'timestamp': record['timestamp'],
+                    'sender_name': record['sender_name'],
+                    'sender_username': record['sender_username'],
+                    'message': record['text']
+                })
+            self.count += 1
+
+    def close(self, source: str):
+        if self.export_format == 'json':
+            self._file.write(f'\n], "source": {json.dumps(source, ensure_ascii=False)}, "count": {self.count}}}')
+        self._file.close()
+
+
+# --- ENTITY CACHE MODULE ---
+class SenderCache:
+    """Bounded LRU cache of senders/chats keyed by marked peer id, with a TTL"""
+
+    def __init__(self, max_size: int = SENDER_CACHE_SIZE, ttl: float = SENDER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # peer_id -> (expires_at, entity)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, peer_id):
+        """Return a cached entity or None; a hit is a fetch the caller no longer needs"""
+        entry = self._entries.get(peer_id)
+        if entry is not None:
+            expires_at, entity = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(peer_id)
+                self.hits += 1
+                return entity
+            del self._entries[peer_id]
+        self.misses += 1
+        return None
+
+    def put(self, entity):
+        """Store a full (non-min) User/Chat/Channel under its marked peer id"""
+        if entity is None or getattr(entity, 'min', False):
+            return
+        try:
+            peer_id = utils.get_peer_id(entity)
+        except (TypeError, ValueError):
+            return
+        self._entries[peer_id] = (time.monotonic() + self.ttl, entity)
+        self._entries.move_to_end(peer_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def prime(self, entities):
+        """Pre-fill from the users/chats Telegram returned alongside a page of messages"""
+        for entity in entities:
+            self.put(entity)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+# --- ARCHIVE MODULE ---
+class MessageArchive:
+    """
+    Persistent SQLite store of fetched messages.
+    Each chat keeps a contiguous [low_id, high_id] range that is known to be
+    fully archived, so repeat scans only pull messages outside that range.
+    Message text is mirrored into an FTS5 index for ranked local search.
+    """
+
+    COLUMNS = ('chat_id', 'id', 'date', 'sender_id', 'sender_name', 'sender_username', 'text', 'has_media')
+
+    def __init__(self, db_path: Path = ARCHIVE_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # `text REGEXP pattern` for .search --regex, evaluated before ranking and LIMIT
+        self.conn.create_function("REGEXP", 2, self._regexp, deterministic=True)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                chat_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                date INTEGER NOT NULL,
+                sender_id INTEGER,
+                sender_name TEXT,
+                sender_username TEXT,
+                text TEXT,
+                has_media INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (chat_id, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_chat_date ON messages (chat_id, date);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                chat_id INTEGER PRIMARY KEY,
+                title TEXT,
+                low_id INTEGER NOT NULL,
+                high_id INTEGER NOT NULL,
+                synced_at INTEGER NOT NULL
+            );
+        """)
+
+        # External-content FTS5 index kept in sync by triggers
+        fts_exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        self.conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                text, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+        """)
+        if not fts_exists:
+            self.conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        self.conn.commit()
+
+        # Chats with a sync range are the ones the local index can answer for
+        self.chat_ids = {row[0] for row in self.conn.execute("SELECT chat_id FROM sync_state")}
+
+    @staticmethod
+    def to_row(chat_id: int, record: Dict) -> Tuple:
+        """Convert a fetch_history message record into an archive row"""
+        return (
+            chat_id,
+            record['id'],
+            int(record['date'].timestamp()),
+            record['sender_id'],
+            record['sender_name'],
+            record['sender_username'],
+            record['text'],
+            1 if record.get('has_media') else 0
+        )
+
+    @staticmethod
+    def from_row(row) -> Dict:
+        """Convert an archive row back into a fetch_history message record"""
+        date = datetime.fromtimestamp(row[2], tz=timezone.utc)
+        return {
+            'id': row[1],
+            'timestamp': date.strftime('%Y-%m-%d %H:%M'),
+            'sender_name': row[4],
+            'sender_username': row[5],
+            'sender_id': row[3],
+            'text': row[6] or '',
+            'date': date,
+            'has_media': bool(row[7])
+        }
+
+    def store(self, rows: List[Tuple]):
+        """Upsert a batch of rows in a single transaction"""
+        if not rows:
+            return
+        # An upsert (rather than INSERT OR REPLACE) keeps the rowid stable and fires
+        # the UPDATE trigger, so the FTS index never holds stale entries.
+        updates = ', '.join(f"{col} = excluded.{col}" for col in self.COLUMNS[2:])
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO messages ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))}) "
+                f"ON CONFLICT (chat_id, id) DO UPDATE SET {updates}",
+                rows
+            )
+
+    def get_range(self, chat_id: int) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT low_id, high_id FROM sync_state WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set_range(self, chat_id: int, title: str, low_id: int, high_id: int):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (chat_id, title, low_id, high_id, synced_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, title, low_id, high_id, int(time.time()))
+            )
+        self.chat_ids.add(chat_id)
+
+    def count_range(self, chat_id: int, low_id: int, high_id: int) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE chat_id = ? AND id BETWEEN ? AND ?",
+                (chat_id, low_id, high_id)
+            ).fetchone()[0]
+
+    def window_start(self, chat_id: int, limit: int, low_id: int) -> int:
+        """Return the id of the oldest message among the newest `limit` archived at or above low_id"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id FROM messages WHERE chat_id = ? AND id >= ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (chat_id, low_id, limit - 1)
+            ).fetchone()
+        return row[0] if row else low_id
+
+    def load_batch(self, chat_id: int, after_id: int, batch_size: int) -> List[Dict]:
+        """Return up to batch_size archived messages with id > after_id, oldest first"""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM messages WHERE chat_id = ? AND id > ? ORDER BY id ASC LIMIT ?",
+                (chat_id, after_id, batch_size)
+            ).fetchall()
+        return [self.from_row(row) for row in rows]
+
+    def clear(self, chat_id: int):
+        """Drop everything archived for a chat so the next sync starts fresh"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self.conn.execute("DELETE FROM sync_state WHERE chat_id = ?", (chat_id,))
+        self.chat_ids.discard(chat_id)
+
+    @staticmethod
+    def _regexp(pattern: str, text: Optional[str]) -> bool:
+        # re caches compiled patterns, so this doesn't recompile per row
+        return text is not None and re.search(pattern, text, re.IGNORECASE) is not None
+
+    @staticmethod
+    def fts_query(query: str) -> str:
+        """
+        Turn user search text into an FTS5 query: "quoted phrases" and prefix*
+        terms are kept, AND/OR/NOT pass through, every other token is quoted so
+        punctuation cannot break the query syntax.
+        """
+        terms = []
+        for token in re.findall(r'"[^"]*"|\S+', query):
+            if token.startswith('"') and token.endswith('"') and len(token) > 1:
+                terms.append(token)
+            elif token in ('AND', 'OR', 'NOT'):
+                terms.append(token)
+            elif token.endswith('*') and len(token) > 1:
+                terms.append('"' + token[:-1].replace('"', '""') + '"*')
+            else:
+                terms.append('"' + token.replace('"', '""') + '"')
+        return ' '.join(terms)
+
+    def search(self, query: str, chat_ids: Optional[List[int]] = None, sender_username: Optional[str] = None,
+               after: Optional[datetime] = None, before: Optional[datetime] = None,
+               limit: int = 50, regex: Optional[str] = None) -> Tuple[List[Dict], Dict]:
+        """
+        BM25-ranked full-text search over archived messages with chat, sender
+        and date facets. Returns (results, facets) where facets holds the total
+        match count and the top chats and senders among all matches.
+        A regex (case-insensitive) narrows the matches before ranking and limiting.
+        """
+        where = ["messages_fts MATCH ?"]
+        params = [self.fts_query(query)]
+        if chat_ids:
+            where.append(f"m.chat_id IN ({', '.join('?' * len(chat_ids))})")
+            params.extend(chat_ids)
+        if sender_username:
+            where.append("m.sender_username = ?")
+            params.append(sender_username)
+        if after:
+            where.append("m.date >= ?")
+            params.append(int(after.timestamp()))
+        if before:
+            where.append("m.date <= ?")
+            params.append(int(before.timestamp()))
+        if regex:
+            re.compile(regex)  # Surface a bad pattern as re.error rather than an SQLite error
+            where.append("m.text REGEXP ?")
+            params.append(regex)
+
+        matches = (
+            "FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+            "LEFT JOIN sync_state s ON s.chat_id = m.chat_id WHERE " + ' AND '.join(where)
+        )
+        columns = ', '.join(f"m.{col}" for col in self.COLUMNS)
+
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {columns}, s.title {matches} ORDER BY bm25(messages_fts) LIMIT ?",
+                params + [limit]
+            ).fetchall()
+            total = self.conn.execute(f"SELECT COUNT(*) {matches}", params).fetchone()[0]
+            top_chats = self.conn.execute(
+                f"SELECT COALESCE(s.title, m.chat_id), COUNT(*) AS n {matches} GROUP BY m.chat_id ORDER BY n DESC LIMIT 5",
+                params
+            ).fetchall()
+            top_senders = self.conn.execute(
+                f"SELECT COALESCE(m.sender_username, m.sender_name), COUNT(*) AS n {matches} "
+                f"GROUP BY m.sender_id ORDER BY n DESC LIMIT 5",
+                params
+            ).fetchall()
+
+        results = []
+        for row in rows:
+            record = self.from_row(row)
+            record['chat_id'] = row[0]
+            record['chat_title'] = row[len(self.COLUMNS)] or str(row[0])
+            results.append(record)
+
+        return results, {'total': total, 'chats': top_chats, 'senders': top_senders}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            chats = self.conn.execute("SELECT COUNT(*) FROM sync_state").fetchone()[0]
+            messages = self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {'chats': chats, 'messages': messages}
+
+
+# --- REPUTATION MODULE ---
+class SenderReputation:
+    """
+    Persistent per-sender spam/clean evidence with exponential decay.
+    All rows are held in memory for O(1) standing() lookups; writes go through to SQLite.
+    """
+
+    def __init__(self, db_path: Path = REPUTATION_DB_PATH, half_life: int = REPUTATION_HALF_LIFE,
+                 bad_threshold: float = REPUTATION_BAD, trusted_threshold: float = REPUTATION_TRUSTED):
+        self.half_life = half_life
+        self.bad_threshold = bad_threshold
+        self.trusted_threshold = trusted_threshold
+        self.skipped_trusted = 0
+        self.actioned_bad = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reputation (
+                sender_id INTEGER PRIMARY KEY,
+                spam REAL NOT NULL,
+                clean REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        # sender_id -> (spam, clean, updated)
+        self._scores = {
+            row[0]: (row[1], row[2], row[3])
+            for row in self.conn.execute("SELECT sender_id, spam, clean, updated FROM reputation")
+        }
+
+    def _decayed(self, sender_id: int, now: float) -> Tuple[float, float]:
+        spam, clean, updated = self._scores.get(sender_id, (0.0, 0.0, now))
+        factor = 0.5 ** ((now - updated) / self.half_life)
+        return spam * factor, clean * factor
+
+    def standing(self, sender_id: Optional[int]) -> str:
+        """'bad', 'trusted' or 'neutral'"""
+        if sender_id is None or sender_id not in self._scores:
+            return 'neutral'
+        spam, clean = self._decayed(sender_id, time.time())
+        if spam >= self.bad_threshold and spam > clean:
+            return 'bad'
+        if clean >= self.trusted_threshold and spam < self.bad_threshold / 6:
+            return 'trusted'
+        return 'neutral'
+
+    def record(self, sender_id: Optional[int], spam: float = 0.0, clean: float = 0.0):
+        """Add decayed evidence for a sender and persist it"""
+        if sender_id is None:
+            return
+        now = time.time()
+        with self._lock:
+            old_spam, old_clean = self._decayed(sender_id, now)
+            row = (old_spam + spam, old_clean + clean, now)
+            self._scores[sender_id] = row
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO reputation (sender_id, spam, clean, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(sender_id) DO UPDATE SET spam = excluded.spam, clean = excluded.clean, "
+                    "updated = excluded.updated",
+                    (sender_id, *row)
+                )
+
+    def record_verdict(self, sender_id: Optional[int], is_spam: bool, confidence: float, source: str = 'model'):
+        """
+        Spam verdicts count whatever produced them; clean evidence only comes from an actual
+        model answer (failed calls report 0.0), so heuristic settles and shared cluster
+        results can't earn trusted standing
+        """
+        if is_spam:
+            self.record(sender_id, spam=REPUTATION_WEIGHTS['verdict'] * confidence)
+        elif source == 'model' and confidence > 0:
+            self.record(sender_id, clean=1.0)
+
+    def record_deletion(self, sender_id: Optional[int], manual: bool = False):
+        self.record(sender_id, spam=REPUTATION_WEIGHTS['manual_delete' if manual else 'auto_delete'])
+
+    def stats(self) -> Dict:
+        standings = Counter(self.standing(sender_id) for sender_id in list(self._scores))
+        return {
+            'senders': len(self._scores),
+            'bad': standings['bad'],
+            'trusted': standings['trusted'],
+            'skipped_trusted': self.skipped_trusted,
+            'actioned_bad': self.actioned_bad
+        }
+
+
+# --- MATCHING MODULE ---
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a fixed keyword set, built once per rule.
+    Matching is NFKC-normalized and case-folded; with `whole_words` a hit
+    must not be flanked by letters, digits or underscores.
+    """
+
+    def __init__(self, terms: List[str], whole_words: bool = False):
+        self.whole_words = whole_words
+        self.terms = []  # Original spelling, indexed by output id
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # state -> [(term index, normalized length)]
+
+        seen = set()
+        for term in terms:
+            normalized = self.normalize(term.strip())
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            self._insert(normalized, len(self.terms))
+            self.terms.append(term.strip())
+        self._link()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return unicodedata.normalize('NFKC', text).casefold()
+
+    def _insert(self, word: str, index: int):
+        state = 0
+        for char in word:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._out[state].append((index, len(word)))
+
+    def _link(self):
+        """Breadth-first failure links; outputs are merged along them"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    @staticmethod
+    def _is_word_char(char: str) -> bool:
+        return char.isalnum() or char == '_'
+
+    def _scan(self, text: str, first_only: bool) -> List[str]:
+        text = self.normalize(text)
+        found = []
+        found_set = set()
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index, length in self._out[state]:
+                if index in found_set:
+                    continue
+                if self.whole_words:
+                    start = pos - length + 1
+                    if (start > 0 and self._is_word_char(text[start - 1])) or \
+                            (pos + 1 < len(text) and self._is_word_char(text[pos + 1])):
+                        continue
+                found_set.add(index)
+                found.append(self.terms[index])
+                if first_only:
+                    return found
+        return found
+
+    def find(self, text: str) -> List[str]:
+        """Keywords present in `text`, in order of first occurrence"""
+        return self._scan(text, first_only=False) if self.terms and text else []
+
+    def matches(self, text: str) -> bool:
+        return bool(self._scan(text, first_only=True)) if self.terms and text else False
+
+
+# --- ROUTING MODULE ---
+class MessageRouter:
+    """
+    One NewMessage handler for all per-chat rules (monitor, forward, auto-mod, capture).
+    Rules are indexed by chat id, so an update only touches the rules for its
+    own chat, and can be added or removed without touching Telethon's handler list.
+    """
+
+    KINDS = ('monitor', 'forward', 'auto-mod', 'capture')
+
+    def __init__(self):
+        self._by_chat = defaultdict(dict)  # chat_id -> {rule_id: (kind, handler)}
+        self._chat_of = {}  # rule_id -> chat_id
+        self._next_id = 0
+        self.dispatched = 0
+
+    def add(self, chat_id: int, kind: str, handler) -> int:
+        """Register `handler(event)` for new messages in `chat_id`; returns the rule id"""
+        rule_id = self._next_id
+        self._next_id += 1
+        self._by_chat[chat_id][rule_id] = (kind, handler)
+        self._chat_of[rule_id] = chat_id
+        return rule_id
+
+    def remove(self, rule_id: int) -> bool:
+        chat_id = self._chat_of.pop(rule_id, None)
+        if chat_id is None:
+            return False
+        rules = self._by_chat[chat_id]
+        rules.pop(rule_id, None)
+        if not rules:
+            del self._by_chat[chat_id]
+        return True
+
+    def remove_kind(self, kind: str) -> int:
+        """Remove every rule of one kind; returns how many were removed"""
+        rule_ids = [
+            rule_id for rules in self._by_chat.values()
+            for rule_id, (rule_kind, _) in rules.items() if rule_kind == kind
+        ]
+        for rule_id in rule_ids:
+            self.remove(rule_id)
+        return len(rule_ids)
+
+    async def dispatch(self, event):
+        rules = self._by_chat.get(event.chat_id)
+        if not rules:
+            return
+        self.dispatched += 1
+        # Rules for the same chat run concurrently so a slow AI call doesn't hold up the others
+        entries = list(rules.values())
+        results = await asyncio.gather(*(handler(event) for _, handler in entries), return_exceptions=True)
+        for (kind, _), result in zip(entries, results):
+            if isinstance(result, Exception):
+                logger.error(f"{kind} rule failed in chat {event.chat_id}: {result}")
+
+    def stats(self) -> Dict:
+        kinds = Counter(kind for rules in self._by_chat.values() for kind, _ in rules.values())
+        return {
+            'chats': len(self._by_chat),
+            'rules': {kind: kinds[kind] for kind in self.KINDS},
+            'dispatched': self.dispatched
+        }
+
+
+# --- OUTBOUND MODULE ---
+class OutboundScheduler:
+    """
+    Process-wide priority queue for outgoing Telegram sends.
+    A single worker releases calls through a token bucket; FloodWaitError pauses
+    the queue for the requested time, halves the rate and retries the same call.
+    Callers await delivery and get the sent message back.
+    """
+
+    def __init__(self, client, per_minute: float = OUTBOUND_PER_MINUTE, burst: float = OUTBOUND_BURST):
+        self.client = client
+        self.max_rate = per_minute
+        self.bucket = TokenBucket(per_minute, capacity=burst)
+        self._heap = []  # (priority, seq, fn, args, kwargs, future, enqueued)
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._paused_until = 0.0
+        self.sent = Counter()
+        self.failed = 0
+        self.flood_waits = 0
+        self.wait_total = defaultdict(float)
+
+    async def call(self, fn, *args, priority: int = SEND_PRIORITY_REPLY, **kwargs):
+        """Queue `await fn(*args, **kwargs)` and wait until it has been delivered"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, self._seq, fn, args, kwargs, future, time.monotonic()))
+        self._seq += 1
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return await future
+
+    async def send_message(self, *args, priority: int = SEND_PRIORITY_REPLY, **kwargs):
+        return await self.call(self.client.send_message, *args, priority=priority, **kwargs)
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Sleep, then re-check the head: something more urgent may have arrived
+            wait = max(self._paused_until - time.monotonic(), self.bucket.wait_time(1))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            entry = heapq.heappop(self._heap)
+            priority, _, fn, args, kwargs, future, enqueued = entry
+            if future.done():
+                continue
+
+            self.bucket.take(1)
+            try:
+                result = await fn(*args, **kwargs)
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                self._paused_until = time.monotonic() + e.seconds
+                self.bucket.set_rate(max(OUTBOUND_MIN_PER_MINUTE, self.bucket.per_minute / 2))
+                logger.warning(f"FloodWait {e.seconds}s on send; outbound rate now {self.bucket.per_minute:.0f}/min")
+                heapq.heappush(self._heap, entry)
+                continue
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+                continue
+
+            if self.bucket.per_minute < self.max_rate:
+                self.bucket.set_rate(min(self.max_rate, self.bucket.per_minute + 1))
+            self.sent[priority] += 1
+            self.wait_total[priority] += time.monotonic() - enqueued
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        queued = Counter(entry[0] for entry in self._heap)
+        lanes = {}
+        for priority, name in SEND_PRIORITY_NAMES.items():
+            sent = self.sent[priority]
+            lanes[name] = {
+                'queued': queued[priority],
+                'sent': sent,
+                'avg_wait': self.wait_total[priority] / sent if sent else 0.0
+            }
+        return {
+            'rate': self.bucket.per_minute,
+            'max_rate': self.max_rate,
+            'flood_waits': self.flood_waits,
+            'failed': self.failed,
+            'lanes': lanes
+        }
+
+
+# --- EVENT HISTORY MODULE ---
+class EditHistory:
+    """
+    Edit versions keyed by (chat_id, msg_id), capped per chat with LRU eviction
+    so memory stays constant however long the service runs.
+    """
+
+    def __init__(self, per_chat: int = EDIT_HISTORY_PER_CHAT, max_versions: int = EDIT_HISTORY_MAX_VERSIONS):
+        self.per_chat = per_chat
+        self.max_versions = max_versions
+        self._chats = {}  # chat_id -> OrderedDict(msg_id -> deque of {'timestamp', 'text'})
+        self.evictions = 0
+
+    def record(self, chat_id: int, msg_id: int, text: str) -> int:
+        """Store a new version and return how many edits are known for the message"""
+        history = self._chats.setdefault(chat_id, OrderedDict())
+        versions = history.get(msg_id)
+        if versions is None:
+            versions = history[msg_id] = deque(maxlen=self.max_versions)
+            if len(history) > self.per_chat:
+                history.popitem(last=False)
+                self.evictions += 1
+        else:
+            history.move_to_end(msg_id)
+        versions.append({'timestamp': datetime.now(), 'text': text})
+        return len(versions)
+
+    def get(self, chat_id: int, msg_id: int) -> List[Dict]:
+        return list(self._chats.get(chat_id, {}).get(msg_id, ()))
+
+    def locate(self, msg_ids: List[int], chat_ids) -> Dict[int, List[int]]:
+        """Group message ids by which of `chat_ids` has them on record"""
+        found = defaultdict(list)
+        for chat_id in chat_ids:
+            history = self._chats.get(chat_id)
+            if history:
+                for msg_id in msg_ids:
+                    if msg_id in history:
+                        found[chat_id].append(msg_id)
+        return found
+
+    def drop_chat(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            'chats': len(self._chats),
+            'messages': sum(len(history) for history in self._chats.values()),
+            'evictions': self.evictions
+        }
+
+
+class MessageRingBuffer:
+    """
+    Per-chat buffer of recent messages so deleted content can be recovered.
+    Entries are compact tuples (date, sender_id, sender_name, text, media_ref, size)
+    keyed by message id for O(1) lookup; each chat is bounded by count and bytes,
+    oldest first. With spill enabled, evicted entries move to SQLite instead of vanishing.
+    """
+
+    ENTRY_OVERHEAD = 64  # Rough per-entry bookkeeping cost in bytes
+
+    def __init__(self, max_messages: int = RING_BUFFER_MAX_MESSAGES, max_bytes: int = RING_BUFFER_MAX_BYTES,
+                 spill: bool = RING_SPILL_ENABLED, spill_path: Path = RING_SPILL_DB_PATH):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._chats = {}  # chat_id -> OrderedDict(msg_id -> entry)
+        self._bytes = defaultdict(int)
+        self._spill_pending = []
+        self.recovered = 0
+        self.missed = 0
+        self.conn = None
+        if spill:
+            self._lock = threading.Lock()
+            self.conn = sqlite3.connect(str(spill_path), check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS spill (
+                    chat_id INTEGER NOT NULL,
+                    id INTEGER NOT NULL,
+                    date INTEGER,
+                    sender_id INTEGER,
+                    sender_name TEXT,
+                    text TEXT,
+                    media_ref TEXT,
+                    PRIMARY KEY (chat_id, id)
+                )
+            """)
+            self.conn.commit()
+
+    def put(self, chat_id: int, msg_id: int, date: int, sender_id: Optional[int], sender_name: str,
+            text: str, media_ref: Optional[str]):
+        """Capture a new message, or replace the stored content on edit"""
+        text = text or ''
+        size = len(text.encode('utf-8')) + len(sender_name or '') + self.ENTRY_OVERHEAD
+        chat = self._chats.setdefault(chat_id, OrderedDict())
+        old = chat.get(msg_id)
+        if old:
+            self._bytes[chat_id] -= old[5]
+        chat[msg_id] = (date, sender_id, sender_name, text, media_ref, size)
+        self._bytes[chat_id] += size
+
+        while chat and (len(chat) > self.max_messages or self._bytes[chat_id] > self.max_bytes):
+            evicted_id, entry = chat.popitem(last=False)
+            self._bytes[chat_id] -= entry[5]
+            if self.conn:
+                self._spill_pending.append((chat_id, evicted_id, *entry[:5]))
+
+    def spill_due(self) -> bool:
+        return len(self._spill_pending) >= RING_SPILL_FLUSH_ROWS
+
+    def flush_spill(self):
+        """Write evicted entries to disk and trim the spill table to its cap (blocking)"""
+        if not self.conn or not self._spill_pending:
+            return
+        rows, self._spill_pending = self._spill_pending, []
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO spill VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute(
+                "DELETE FROM spill WHERE rowid <= (SELECT MAX(rowid) FROM spill) - ?", (RING_SPILL_MAX_ROWS,)
+            )
+
+    def pop(self, chat_id: int, msg_ids: List[int]) -> Tuple[Dict[int, Tuple], List[int]]:
+        """Remove and return buffered entries for deleted ids, plus the ids not held in memory"""
+        chat = self._chats.get(chat_id, {})
+        found, missing = {}, []
+        for msg_id in msg_ids:
+            entry = chat.pop(msg_id, None)
+            if entry:
+                self._bytes[chat_id] -= entry[5]
+                found[msg_id] = entry[:5]
+            else:
+                missing.append(msg_id)
+        return found, missing
+
+    def pop_spilled(self, chat_id: int, msg_ids: List[int]) -> Dict[int, Tuple]:
+        """Disk fallback for pop() (blocking)"""
+        if not self.conn or not msg_ids:
+            return {}
+        self.flush_spill()
+        placeholders = ','.join('?' * len(msg_ids))
+        with self._lock, self.conn:
+            rows = self.conn.execute(
+                f"SELECT id, date, sender_id, sender_name, text, media_ref FROM spill "
+                f"WHERE chat_id = ? AND id IN ({placeholders})", (chat_id, *msg_ids)
+            ).fetchall()
+            self.conn.execute(
+                f"DELETE FROM spill WHERE chat_id = ? AND id IN ({placeholders})", (chat_id, *msg_ids)
+            )
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def locate(self, msg_ids: List[int], chat_ids) -> Dict[int, List[int]]:
+        """Group message ids by which of `chat_ids` holds them in memory"""
+        found = defaultdict(list)
+        for chat_id in chat_ids:
+            chat = self._chats.get(chat_id)
+            if chat:
+                for msg_id in msg_ids:
+                    if msg_id in chat:
+                        found[chat_id].append(msg_id)
+        return found
+
+    def locate_spilled(self, msg_ids: List[int], chat_ids) -> Dict[int, List[int]]:
+        """Disk fallback for locate() (blocking)"""
+        chat_ids = list(chat_ids)
+        if not self.conn or not msg_ids or not chat_ids:
+            return {}
+        self.flush_spill()
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT chat_id, id FROM spill WHERE id IN ({','.join('?' * len(msg_ids))}) "
+                f"AND chat_id IN ({','.join('?' * len(chat_ids))})", (*msg_ids, *chat_ids)
+            ).fetchall()
+        found = defaultdict(list)
+        for chat_id, msg_id in rows:
+            found[chat_id].append(msg_id)
+        return found
+
+    def drop_chat(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+        self._bytes.pop(chat_id, None)
+
+    def record_outcome(self, recovered: int, missed: int):
+        self.recovered += recovered
+        self.missed += missed
+
+    def stats(self) -> Dict:
+        return {
+            'chats': len(self._chats),
+            'messages': sum(len(chat) for chat in self._chats.values()),
+            'bytes': sum(self._bytes.values()),
+            'recovered': self.recovered,
+            'missed': self.missed,
+            'spill': self.conn is not None
+        }
+
+
+# --- FORWARDING MODULE ---
+class ForwardQueue:
+    """
+    Ordered outbound queue for one auto-forward destination.
+    Coalesces messages arriving within a short window into one forward_messages
+    call per source chat, never splits an album (grouped_id), and waits out
+    FloodWaitError instead of dropping. Per-rule counters live on the rule dicts.
+    """
+
+    def __init__(self, client, destination, dest_name: str, window: float = FORWARD_BATCH_WINDOW,
+                 max_batch: int = FORWARD_MAX_BATCH):
+        self.client = client
+        self.destination = destination
+        self.dest_name = dest_name
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def enqueue(self, msg, rule: Dict):
+        rule['pending'] += 1
+        self._queue.put_nowait((msg, rule, time.monotonic()))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _drain(self) -> List:
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.window)
+            batch.extend(self._drain())
+
+            # A trailing album may still be arriving
+            while batch[-1][0].grouped_id:
+                await asyncio.sleep(FORWARD_ALBUM_GRACE)
+                more = self._drain()
+                if not more:
+                    break
+                batch.extend(more)
+
+            for chunk in self._chunks(batch):
+                await self._send(chunk)
+
+    def _chunks(self, batch: List) -> List[List]:
+        """Split into per-source runs of at most max_batch ids, keeping albums whole"""
+        units = []
+        for item in batch:
+            msg = item[0]
+            last = units[-1][-1][0] if units else None
+            if last and msg.grouped_id and last.grouped_id == msg.grouped_id and last.chat_id == msg.chat_id:
+                units[-1].append(item)
+            else:
+                units.append([item])
+
+        chunks = []
+        for unit in units:
+            current = chunks[-1] if chunks else None
+            if current and current[0][0].chat_id == unit[0][0].chat_id and len(current) + len(unit) <= self.max_batch:
+                current.extend(unit)
+            else:
+                chunks.append(list(unit))
+        return chunks
+
+    async def _send(self, chunk: List):
+        source = chunk[0][1]['source']
+        # Two rules from the same source can queue the same message; forward it once
+        ids = list(dict.fromkeys(msg.id for msg, _, _ in chunk))
+        rules = {id(rule): rule for _, rule, _ in chunk}.values()
+        sent = False
+
+        for attempt in range(FORWARD_MAX_RETRIES + 1):
+            try:
+                await self.client.forward_messages(self.destination, ids, from_peer=source)
+                sent = True
+                break
+            except FloodWaitError as e:
+                for rule in rules:
+                    rule['flood_waits'] += 1
+                logger.warning(f"FloodWait {e.seconds}s forwarding {len(ids)} message(s) to {self.dest_name}; retrying")
+                await asyncio.sleep(e.seconds + 1)
+            except Exception as e:
+                logger.error(f"Auto-forward to {self.dest_name} failed: {e}")
+                break
+
+        now = time.monotonic()
+        for msg, rule, enqueued in chunk:
+            rule['pending'] -= 1
+            if sent:
+                latency = now - enqueued
+                rule['count'] += 1
+                rule['latency_total'] += latency
+                rule['latency_max'] = max(rule['latency_max'], latency)
+            else:
+                rule['failed'] += 1
+        if sent:
+            logger.info(f"Auto-forwarded {len(ids)} message(s) from {chunk[0][1]['source_name']} to {self.dest_name}")
+
+
+# --- JOB SCHEDULER MODULE ---
+class JobScheduler:
+    """
+    In-loop scheduler backed by a heap of next-run times.
+    Job definitions live in SQLite, so they survive restarts; a job whose run was
+    missed while the process was down runs once shortly after start-up. Every run
+    is jittered and at most JOB_MAX_CONCURRENT jobs execute at a time.
+    Runners are registered per job kind and receive the job dict.
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB_PATH, max_concurrent: int = JOB_MAX_CONCURRENT):
+        self.runners = {}  # kind -> async callable(job)
+        self.jobs = {}  # job id -> job dict
+        self._heap = []  # (run_at, job_id)
+        self._running = set()
+        self._executions = set()  # Strong refs so running jobs aren't garbage-collected
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped_overlaps = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                frequency TEXT NOT NULL,
+                params TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT '{}',
+                due REAL NOT NULL,
+                run_at REAL NOT NULL,
+                last_run REAL,
+                created REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        for row in self.conn.execute(
+            "SELECT id, kind, frequency, params, state, due, run_at, last_run, created FROM jobs"
+        ):
+            self.jobs[row[0]] = {
+                'id': row[0], 'kind': row[1], 'frequency': row[2], 'params': json.loads(row[3]),
+                'state': json.loads(row[4]), 'due': row[5], 'run_at': row[6], 'last_run': row[7], 'created': row[8]
+            }
+
+    @staticmethod
+    def next_due(frequency: str, after: float) -> float:
+        """Next un-jittered run time strictly after `after` (hourly, or daily/weekly at JOB_RUN_TIME)"""
+        if frequency == 'hourly':
+            return after + 3600
+        hour, minute = (int(x) for x in JOB_RUN_TIME.split(':'))
+        moment = datetime.fromtimestamp(after).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        step = timedelta(days=1)
+        while moment.timestamp() <= after or (frequency == 'weekly' and moment.weekday() != 0):
+            moment += step
+        return moment.timestamp()
+
+    def _save(self, job: Dict):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET due = ?, run_at = ?, last_run = ?, state = ? WHERE id = ?",
+                (job['due'], job['run_at'], job['last_run'], json.dumps(job['state'], default=str), job['id'])
+            )
+
+    def _push(self, job: Dict):
+        heapq.heappush(self._heap, (job['run_at'], job['id']))
+        self._wakeup.set()
+
+    def register(self, kind: str, runner):
+        self.runners[kind] = runner
+
+    def start(self):
+        """Queue persisted jobs (catching up missed runs) and start the loop"""
+        now = time.time()
+        for job in self.jobs.values():
+            if job['run_at'] <= now:
+                logger.info(f"Job #{job['id']} missed its run at {datetime.fromtimestamp(job['run_at'])}; catching up")
+                job['run_at'] = now + random.uniform(0, JOB_CATCHUP_JITTER)
+                self._save(job)
+            self._push(job)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _insert(self, job: Dict) -> int:
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (kind, frequency, params, due, run_at, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job['kind'], job['frequency'], json.dumps(job['params']), job['due'], job['run_at'], job['created'])
+            )
+        return cursor.lastrowid
+
+    async def add(self, kind: str, frequency: str, params: Dict) -> Dict:
+        """Persist a new job, then queue it; only the insert leaves the event loop"""
+        now = time.time()
+        due = self.next_due(frequency, now)
+        job = {
+            'id': None, 'kind': kind, 'frequency': frequency, 'params': params, 'state': {},
+            'due': due, 'run_at': due + random.uniform(0, JOB_JITTER), 'last_run': None, 'created': now
+        }
+        job['id'] = await asyncio.to_thread(self._insert, job)
+        self.jobs[job['id']] = job
+        self._push(job)
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """Drop a job; its heap entry is discarded lazily"""
+        if self.jobs.pop(job_id, None) is None:
+            return False
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self._wakeup.set()
+        return True
+
+    def list(self, kind: Optional[str] = None) -> List[Dict]:
+        return sorted((j for j in self.jobs.values() if kind is None or j['kind'] == kind), key=lambda j: j['run_at'])
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            run_at, job_id = self._heap[0]
+            job = self.jobs.get(job_id)
+            if job is None or job['run_at'] != run_at:
+                heapq.heappop(self._heap)  # Cancelled or rescheduled
+                continue
+
+            delay = run_at - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    # Capped so wall-clock jumps (suspend, NTP) are noticed
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, 300))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            now = time.time()
+            due = job['due']
+            while due <= now:
+                due = self.next_due(job['frequency'], due)
+            job['due'] = due
+            job['run_at'] = due + random.uniform(0, JOB_JITTER)
+            self._save(job)
+            self._push(job)
+
+            if job_id in self._running:
+                self.skipped_overlaps += 1
+                logger.warning(f"Job #{job_id} still running from its previous run; skipping this one")
+                continue
+            execution = asyncio.create_task(self._execute(job))
+            self._executions.add(execution)
+            execution.add_done_callback(self._executions.discard)
+
+    async def _execute(self, job: Dict):
+        self._running.add(job['id'])
+        try:
+            async with self._slots:
+                await self.runners[job['kind']](job)
+            self.runs += 1
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Job #{job['id']} ({job['kind']}) failed: {e}")
+        finally:
+            self._running.discard(job['id'])
+            job['last_run'] = time.time()
+            if job['id'] in self.jobs:
+                await asyncio.to_thread(self._save, job)
+
+    def stats(self) -> Dict:
+        upcoming = min((j['run_at'] for j in self.jobs.values()), default=None)
+        return {
+            'jobs': len(self.jobs),
+            'running': len(self._running),
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped_overlaps': self.skipped_overlaps,
+            'next_run': upcoming
+        }
+
+
 # --- OPERATIONS MODULE (TELEGRAM) ---
 class AtlasClient:
     def __init__(self):
         self.client = TelegramClient('atlas_session', API_ID, API_HASH)
         self.ai = IntelligenceUnit(GEMINI_KEY)
         self.user_me = None
-        self.monitoring_tasks = {}  # Track active monitoring tasks
+        self.monitoring_tasks = {}  # Active monitors: chat title -> router rule id
         self.export_handler = ExportHandler()
         self.auto_forward_rules = []  # Auto-forwarding rules
+        self.forward_queues = {}  # Destination peer id -> ForwardQueue
+        self.outbound = OutboundScheduler(self.client)  # Rate-limited, prioritized sends
         self.auto_mod_rules = {}  # Auto-moderation rules by chat
-        self.scheduled_reports = []  # Scheduled report tasks
-        self.event_monitors = {}  # Advanced event monitoring (edits, deletes, online status)
-        self.deleted_messages_cache = {}  # Track deleted messages
-        self.edited_messages_cache = {}  # Track message edits
+        self.jobs = JobScheduler()  # Persistent scheduled jobs (.schedule-report)
+        self.jobs.register('report', self._run_scheduled_report)
+        self.event_monitors = {}  # Advanced event monitoring by chat id (edits, deletes, online status)
+        self.message_buffer = MessageRingBuffer()  # Recent messages of delete-watched chats
+        self.edit_history = EditHistory()  # Message edit versions by (chat_id, msg_id)
+        self.sender_cache = SenderCache()  # Shared sender/chat resolution cache
+        self.archive = MessageArchive()  # Local message store for incremental sync
+        self.media_cache = MediaAnalysisCache()  # Persistent media analysis results
+        self.router = MessageRouter()  # Per-chat monitor/forward/auto-mod rules
+        self.reputation = SenderReputation()  # Decaying per-sender spam/clean evidence
+        self.dup_index = NearDuplicateIndex()  # Recent messages from watched/moderated chats, clustered
+        self.spam_batcher = SpamMicroBatcher(self.ai, self.dup_index)  # Auto-mod spam checks, batched per window
 
     async def start(self):
         """Bootstraps the connection and registers event hooks."""
@@ -234,6 +2651,7 @@ class AtlasClient:
         logger.info("  Moderation: .auto-mod, .delete, .detect-spam")
         logger.info("  Automation: .schedule-report, .stop")
         logger.info("  Export: .export, .export-raw")
+        logger.info("  Diagnostics: .stats")
 
         # Register the Command Listener
         self.client.add_event_handler(self.handle_command, events.NewMessage(outgoing=True, chats='me'))
@@ -242,81 +2660,105 @@ class AtlasClient:
         self.client.add_event_handler(self.handle_message_edit, events.MessageEdited())
         self.client.add_event_handler(self.handle_message_delete, events.MessageDeleted())
 
-        # Start scheduler thread for automated reports
-        scheduler_thread = threading.Thread(target=self._run_scheduler, daemon=True)
-        scheduler_thread.start()
+        # Single entry point for all per-chat rules (.watch, .auto-forward, .auto-mod)
+        self.client.add_event_handler(self.router.dispatch, events.NewMessage())
+
+        # Keep archived chats and the local search index current
+        self.client.add_event_handler(self.handle_archive_message, events.NewMessage())
+        self.client.add_event_handler(self.handle_archive_message, events.MessageEdited())
+
+        # Resume persisted scheduled reports (catching up on runs missed while offline)
+        self.jobs.start()
 
         # Keep the script running
         await self.client.run_until_disconnected()
 
-    async def fetch_history(self, chat_input, limit=100, include_media=False, filters=None):
-        """Scrapes history from public OR private chats with optional media analysis and filters."""
+    async def resolve_sender(self, msg):
+        """Resolve a message's sender through the shared cache, fetching only on a miss"""
+        return await self._resolve_cached(msg.sender_id, msg.sender, msg.get_sender)
+
+    async def resolve_chat(self, msg):
+        """Resolve a message's chat through the shared cache, fetching only on a miss"""
+        return await self._resolve_cached(msg.chat_id, msg.chat, msg.get_chat)
+
+    async def _resolve_cached(self, peer_id, page_entity, fetch):
+        if peer_id is None:
+            return None
+        # Telethon attaches the users/chats returned with each history page to
+        # the message itself, so prime the cache from those. A full entity on the
+        # page needs no lookup at all, so it isn't counted as a cache hit.
+        if page_entity is not None and not getattr(page_entity, 'min', False):
+            self.sender_cache.prime([page_entity])
+            return page_entity
+        entity = self.sender_cache.get(peer_id)
+        if entity is None:
+            entity = await fetch()
+            self.sender_cache.put(entity)
+        return entity
+
+    async def fetch_history(self, chat_input, limit=100, include_media=False, filters=None, refresh=False):
+        """
+        Scrapes history from public OR private chats with optional media analysis and filters.
+        Plain scans are synced incrementally into the local archive and served from disk;
+        pass refresh=True to drop the archived copy and re-download it.
+        Time windows go in filters as after_date/before_date; the scan is then bounded
+        by id boundaries found from those dates, and limit=None reads up to WINDOW_SCAN_LIMIT.
+        """
         messages_buffer = []
         media_analyses = []
         raw_messages = []  # Store raw message objects for filtering
 
+        if limit is None:
+            limit = WINDOW_SCAN_LIMIT
+
         try:
-            # Convert numeric channel IDs to integers
-            if isinstance(chat_input, str) and chat_input.lstrip('-').isdigit():
-                chat_input = int(chat_input)
+            entity, chat_title = await self.resolve_target(chat_input)
 
-            entity = await self.client.get_entity(chat_input)
-            chat_title = getattr(entity, 'title', getattr(entity, 'username', 'Unknown Chat'))
+            logger.info(f"Target Acquired: {chat_title}. Scanning {self._describe_scope(limit, filters)}...")
 
-            logger.info(f"Target Acquired: {chat_title}. Scanning last {limit} messages...")
+            if not include_media:
+                async for batch in self.iter_history_batches(entity, chat_title, limit, filters=filters, refresh=refresh):
+                    raw_messages.extend(batch)
+                messages_buffer = [
+                    f"[{m['timestamp']}] {m['sender_name']}: {m['text']}" for m in raw_messages if m['text']
+                ]
+                return chat_title, "\n".join(messages_buffer), raw_messages
 
-            async for msg in self.client.iter_messages(entity, limit=limit):
-                # Apply filters if provided
-                if filters:
-                    if not self._apply_filters(msg, filters):
-                        continue
+            server_kwargs, local_filters = self._plan_filters(filters or {})
+            after_date = (filters or {}).get('after_date')
 
-                timestamp = msg.date.strftime('%Y-%m-%d %H:%M')
-                sender = await msg.get_sender()
-                sender_name = getattr(sender, 'first_name', 'Unknown') if sender else "Unknown"
-                sender_username = getattr(sender, 'username', '') if sender else ""
-
-                # Store raw message data
-                raw_messages.append({
-                    'id': msg.id,
-                    'timestamp': timestamp,
-                    'sender_name': sender_name,
-                    'sender_username': sender_username,
-                    'sender_id': sender.id if sender else None,
-                    'text': msg.text or '',
-                    'date': msg.date
-                })
-
-                # Text messages
-                if msg.text:
-                    messages_buffer.append(f"[{timestamp}] {sender_name}: {msg.text}")
-
-                # Media analysis
-                if include_media and msg.media:
-                    try:
-                        if isinstance(msg.media, MessageMediaPhoto):
-                            photo_path = await msg.download_media(file=EXPORTS_DIR / f"temp_photo_{msg.id}.jpg")
-                            if photo_path:
-                                analysis = await self.ai.analyze_media(photo_path, "image")
-                                media_analyses.append(f"[{timestamp}] 📷 Photo Analysis: {analysis}")
-                                os.remove(photo_path)
-
-                        elif isinstance(msg.media, MessageMediaDocument):
-                            # Handle documents/videos/voice
-                            doc_path = await msg.download_media(file=EXPORTS_DIR / f"temp_doc_{msg.id}")
-                            if doc_path:
-                                file_ext = Path(doc_path).suffix.lower()
-                                if file_ext in ['.mp4', '.avi', '.mov']:
-                                    media_type = "video"
-                                elif file_ext in ['.ogg', '.mp3', '.wav', '.m4a']:
-                                    media_type = "audio/voice message"
-                                else:
-                                    media_type = "document"
-                                analysis = await self.ai.analyze_media(doc_path, media_type)
-                                media_analyses.append(f"[{timestamp}] 📎 {media_type.title()} Analysis: {analysis}")
-                                os.remove(doc_path)
-                    except Exception as e:
-                        logger.warning(f"Media analysis skipped for message {msg.id}: {e}")
+            # Downloads and analyses run in the pipeline while the scan continues
+            pipeline = MediaPipeline(self.ai, self.media_cache)
+            try:
+                async for msg in self.client.iter_messages(
+                    entity, limit=limit, offset_date=(filters or {}).get('before_date'), **server_kwargs
+                ):
+                    if after_date and msg.date < after_date:
+                        break
+                    # Apply residual filters if provided
+                    if local_filters:
+                        if not self._apply_filters(msg, local_filters):
+                            continue
+
+                    # Store raw message data
+                    record = await self._message_record(msg)
+                    raw_messages.append(record)
+                    timestamp = record['timestamp']
+
+                    # Text messages
+                    if msg.text:
+                        messages_buffer.append(f"[{timestamp}] {record['sender_name']}: {msg.text}")
+
+                    # Media analysis
+                    if isinstance(msg.media, (MessageMediaPhoto, MessageMediaDocument)):
+                        await pipeline.submit(msg, timestamp)
+
+                media_analyses = await pipeline.finish()
+            except Exception:
+                pipeline.cancel()
+                raise
+
+            logger.info(f"Sender cache after scan: {self.sender_cache.stats()}")
 
             # Combine text and media analyses
             all_content = messages_buffer[::-1]  # Reverse for chronological order
@@ -325,107 +2767,364 @@ class AtlasClient:
 
             return chat_title, "\n".join(all_content), raw_messages[::-1]
 
-        except ChannelPrivateError:
-            return None, "❌ Error: This is a private channel you are not part of.", []
-        except ValueError:
-            return None, "❌ Error: Could not find that chat. Check the username/link.", []
         except Exception as e:
-            logger.error(f"Fetch Error: {e}")
-            return None, f"❌ System Error: {str(e)}", []
+            return None, self._describe_fetch_error(e), []
 
-    def _apply_filters(self, msg, filters):
-        """Apply filters to a message"""
-        # Keyword filter
-        if 'keyword' in filters:
-            if not msg.text or filters['keyword'].lower() not in msg.text.lower():
-                return False
+    @staticmethod
+    def _describe_fetch_error(error: Exception) -> str:
+        """Map a history fetch failure to the user-facing error line"""
+        if isinstance(error, ChannelPrivateError):
+            return "❌ Error: This is a private channel you are not part of."
+        if isinstance(error, ValueError):
+            return "❌ Error: Could not find that chat. Check the username/link."
+        logger.error(f"Fetch Error: {error}")
+        return f"❌ System Error: {str(error)}"
 
-        # Regex filter
-        if 'regex' in filters:
-            if not msg.text or not re.search(filters['regex'], msg.text, re.IGNORECASE):
-                return False
+    @staticmethod
+    def _parse_time_window(parts: List[str]) -> Tuple[Dict, List[str]]:
+        """
+        Pull --since <N>[m|h|d|w] and --between <start> <end> out of a command's parts.
+        Bounds are UTC dates (YYYY-MM-DD) or times (YYYY-MM-DDTHH:MM).
+        Returns (filters with after_date/before_date, remaining parts); raises ValueError.
+        """
+        window = {}
+        rest = []
+        i = 0
+        while i < len(parts):
+            if parts[i] == '--since':
+                match = re.fullmatch(r'(\d+)([mhdw])', parts[i + 1].lower()) if i + 1 < len(parts) else None
+                if not match:
+                    raise ValueError("--since expects a duration like 30m, 24h, 7d or 2w")
+                span = timedelta(seconds=int(match.group(1)) * WINDOW_UNITS[match.group(2)])
+                window['after_date'] = datetime.now(timezone.utc) - span
+                i += 2
+            elif parts[i] == '--between':
+                if i + 2 >= len(parts):
+                    raise ValueError("--between expects a start and an end")
+                bounds = []
+                for value in parts[i + 1:i + 3]:
+                    try:
+                        bound = datetime.strptime(value, '%Y-%m-%dT%H:%M' if 'T' in value else '%Y-%m-%d')
+                    except ValueError:
+                        raise ValueError(f"bad date {value!r}, use YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+                    bounds.append(bound.replace(tzinfo=timezone.utc))
+                if bounds[0] >= bounds[1]:
+                    raise ValueError("--between start must be before its end")
+                window['after_date'], window['before_date'] = bounds
+                i += 3
+            else:
+                rest.append(parts[i])
+                i += 1
+        return window, rest
+
+    @staticmethod
+    def _describe_scope(limit, window=None) -> str:
+        """Human-readable scan scope for status lines and report headers"""
+        after_date = (window or {}).get('after_date')
+        before_date = (window or {}).get('before_date')
+        if not after_date and not before_date:
+            return f"last {limit} messages"
+        scope = "messages"
+        if after_date:
+            scope += f" from {after_date.strftime('%Y-%m-%d %H:%M')}"
+        scope += f" to {before_date.strftime('%Y-%m-%d %H:%M') if before_date else 'now'} UTC"
+        if limit is not None and limit != WINDOW_SCAN_LIMIT:
+            scope += f" (max {limit})"
+        return scope
+
+    async def resolve_target(self, chat_input):
+        """Resolve a username, link or numeric id to (entity, chat_title)"""
+        # Convert numeric channel IDs to integers
+        if isinstance(chat_input, str) and chat_input.lstrip('-').isdigit():
+            chat_input = int(chat_input)
+
+        entity = await self.client.get_entity(chat_input)
+        chat_title = getattr(entity, 'title', getattr(entity, 'username', 'Unknown Chat'))
+        return entity, chat_title
+
+    async def iter_history_batches(self, entity, chat_title, limit=100, batch_size=HISTORY_BATCH_SIZE,
+                                   filters=None, refresh=False):
+        """
+        Yield the newest `limit` messages of a chat as lists of message records,
+        oldest first, without holding more than one batch in memory.
+        Unfiltered scans are synced into and streamed from the archive. Filtered
+        scans push what they can into Telegram's search (see _plan_filters), so
+        `limit` bounds the number of server-side candidates, and iterate those
+        forward from the window boundary.
+        """
+        if not filters:
+            chat_id = utils.get_peer_id(entity)
+            low_id = await self._sync_archive(entity, chat_title, limit, refresh)
+            if low_id is None:
+                return
+
+            start_id = await asyncio.to_thread(self.archive.window_start, chat_id, limit, low_id)
+            after_id = start_id - 1
+            while True:
+                batch = await asyncio.to_thread(self.archive.load_batch, chat_id, after_id, batch_size)
+                if not batch:
+                    return
+                yield batch
+                after_id = batch[-1]['id']
+
+        server_kwargs, local_filters = self._plan_filters(filters)
+        after_date = filters.get('after_date')
+        before_date = filters.get('before_date')
+
+        # The limit-th newest candidate before `before_date` marks where the window starts
+        boundary = await self.client.get_messages(
+            entity, limit=1, add_offset=limit - 1, offset_date=before_date, **server_kwargs
+        )
+        min_id = boundary[0].id - 1 if boundary else 0
+
+        # ...unless `after_date` starts it later: the newest message before it is the id floor
+        if after_date:
+            floor = await self.client.get_messages(entity, limit=1, offset_date=after_date)
+            if floor:
+                min_id = max(min_id, floor[0].id)
+
+        # Iterate forward from the id floor. after_date is never passed as offset_date here:
+        # search requests send it as max_date, and a non-zero min_id drops it anyway.
+        batch = []
+        async for msg in self.client.iter_messages(
+            entity, limit=limit, min_id=min_id, reverse=True, **server_kwargs
+        ):
+            if before_date and msg.date > before_date:
+                break
+            if after_date and msg.date < after_date:
+                continue
+            if local_filters and not self._apply_filters(msg, local_filters):
+                continue
+            batch.append(await self._message_record(msg))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    async def _message_record(self, msg) -> Dict:
+        """Build the raw message record shared by fetch_history and the archive"""
+        sender = await self.resolve_sender(msg)
+        return {
+            'id': msg.id,
+            'timestamp': msg.date.strftime('%Y-%m-%d %H:%M'),
+            'sender_name': getattr(sender, 'first_name', 'Unknown') if sender else "Unknown",
+            'sender_username': getattr(sender, 'username', '') if sender else "",
+            'sender_id': sender.id if sender else None,
+            'text': msg.text or '',
+            'date': msg.date,
+            'has_media': bool(msg.media)
+        }
+
+    async def _archive_messages(self, chat_id, messages) -> Tuple[int, Optional[int], Optional[int]]:
+        """Store messages from an async iterator in batches. Returns (count, min_id, max_id)."""
+        batch = []
+        count, min_id, max_id = 0, None, None
+
+        async for msg in messages:
+            record = await self._message_record(msg)
+            batch.append(MessageArchive.to_row(chat_id, record))
+            count += 1
+            min_id = msg.id if min_id is None else min(min_id, msg.id)
+            max_id = msg.id if max_id is None else max(max_id, msg.id)
+
+            if len(batch) >= ARCHIVE_BATCH_SIZE:
+                await asyncio.to_thread(self.archive.store, batch)
+                batch = []
+
+        await asyncio.to_thread(self.archive.store, batch)
+        return count, min_id, max_id
+
+    async def _pull_new_messages(self, entity, chat_id, low_id, high_id, limit) -> Tuple[int, int, int]:
+        """Archive up to `limit` messages above high_id. Returns the updated (low_id, high_id, count)."""
+        new_count, oldest, newest = await self._archive_messages(
+            chat_id, self.client.iter_messages(entity, limit=limit, min_id=high_id)
+        )
+        if new_count:
+            if new_count >= limit:
+                # More new messages than requested: the old range is no longer contiguous
+                low_id = oldest
+            high_id = newest
+        return low_id, high_id, new_count
+
+    async def _catch_up_archive(self, entity, chat_title):
+        """Pull messages that arrived since the last sync so a local search sees them"""
+        chat_id = utils.get_peer_id(entity)
+        state = await asyncio.to_thread(self.archive.get_range, chat_id)
+        if not state:
+            return
+        low_id, high_id, new_count = await self._pull_new_messages(entity, chat_id, *state, ARCHIVE_CATCHUP_LIMIT)
+        if new_count:
+            await asyncio.to_thread(self.archive.set_range, chat_id, chat_title, low_id, high_id)
+
+    async def _archive_covers(self, entity, chat_id, after_date=None) -> bool:
+        """
+        True if the archived range holds everything a search back to `after_date`
+        (or the start of the chat) could match, i.e. nothing older than low_id is in scope
+        """
+        state = await asyncio.to_thread(self.archive.get_range, chat_id)
+        if not state:
+            return False
+        older = await self.client.get_messages(entity, limit=1, max_id=state[0])
+        return not older or bool(after_date and older[0].date < after_date)
+
+    async def handle_archive_message(self, event):
+        """Keep archived chats (and their search index) current as messages arrive or are edited"""
+        if event.chat_id not in self.archive.chat_ids:
+            return
+        try:
+            record = await self._message_record(event.message)
+            await asyncio.to_thread(self.archive.store, [MessageArchive.to_row(event.chat_id, record)])
+        except Exception as e:
+            logger.error(f"Archive update failed: {e}")
+
+    async def _sync_archive(self, entity, chat_title, limit, refresh=False) -> Optional[int]:
+        """
+        Bring the archived range for a chat up to date so it covers at least the
+        newest `limit` messages. Returns the range's low id, or None for an empty chat.
+        """
+        chat_id = utils.get_peer_id(entity)
+
+        if refresh:
+            await asyncio.to_thread(self.archive.clear, chat_id)
+
+        state = await asyncio.to_thread(self.archive.get_range, chat_id)
+        low_id, high_id = state if state else (None, None)
+        new_count = backfill_count = 0
+
+        # Pull only what arrived since the high watermark
+        if state:
+            low_id, high_id, new_count = await self._pull_new_messages(entity, chat_id, low_id, high_id, limit)
+
+        # Backfill older history until the contiguous range covers `limit`
+        archived = 0
+        if low_id is not None:
+            archived = await asyncio.to_thread(self.archive.count_range, chat_id, low_id, high_id)
+        if archived < limit:
+            backfill_count, oldest, newest = await self._archive_messages(
+                chat_id, self.client.iter_messages(entity, limit=limit - archived, offset_id=low_id or 0)
+            )
+            if backfill_count:
+                low_id = oldest
+                high_id = newest if high_id is None else max(high_id, newest)
 
-        # Sender filter
+        if low_id is None:
+            return None
+
+        await asyncio.to_thread(self.archive.set_range, chat_id, chat_title, low_id, high_id)
+        logger.info(f"Archive sync for {chat_title}: {new_count} new, {backfill_count} backfilled")
+        logger.info(f"Sender cache after scan: {self.sender_cache.stats()}")
+
+        return low_id
+
+    def _plan_filters(self, filters) -> Tuple[Dict, Dict]:
+        """
+        Split search filters into iter_messages kwargs that Telegram evaluates
+        server-side and the residual predicates that must run locally.
+        Date bounds are handled by the caller as id boundaries plus a local date check.
+        Returns (server_kwargs, local_filters).
+        """
+        server_kwargs = {}
+        local_filters = {}
+
+        if 'keyword' in filters:
+            server_kwargs['search'] = filters['keyword']
         if 'from_user' in filters:
-            sender = msg.sender
-            if sender:
-                username = getattr(sender, 'username', '')
-                if username != filters['from_user'].lstrip('@'):
-                    return False
-            else:
-                return False
+            server_kwargs['from_user'] = filters['from_user']
+        if 'media_type' in filters:
+            server_kwargs['filter'] = SEARCH_MEDIA_FILTERS[filters['media_type']]
 
-        # Date filter
-        if 'after_date' in filters:
-            if msg.date < filters['after_date']:
-                return False
+        # Compiled once per search instead of once per message
+        if 'regex' in filters:
+            local_filters['regex'] = re.compile(filters['regex'], re.IGNORECASE)
+        if 'has_media' in filters:
+            local_filters['has_media'] = filters['has_media']
+
+        return server_kwargs, local_filters
 
-        if 'before_date' in filters:
-            if msg.date > filters['before_date']:
+    def _apply_filters(self, msg, local_filters):
+        """Apply the residual client-side filters produced by _plan_filters"""
+        # Regex filter
+        if 'regex' in local_filters:
+            if not msg.text or not local_filters['regex'].search(msg.text):
                 return False
 
         # Media filter
-        if 'has_media' in filters:
-            if filters['has_media'] and not msg.media:
+        if 'has_media' in local_filters:
+            if local_filters['has_media'] and not msg.media:
                 return False
-            if not filters['has_media'] and msg.media:
+            if not local_filters['has_media'] and msg.media:
                 return False
 
         return True
 
-    async def monitor_channel(self, chat_input, keywords: Optional[List[str]] = None):
+    async def monitor_channel(self, chat_input, keywords: Optional[List[str]] = None, whole_words: bool = False):
         """Real-time monitoring of a channel with optional keyword alerts"""
         try:
             entity = await self.client.get_entity(chat_input)
             chat_title = getattr(entity, 'title', getattr(entity, 'username', 'Unknown'))
 
             logger.info(f"Starting real-time monitoring of: {chat_title}")
+            matcher = KeywordMatcher(keywords, whole_words) if keywords else None
 
-            @self.client.on(events.NewMessage(chats=entity))
             async def monitor_handler(event):
                 msg = event.message
                 if msg.text:
                     timestamp = msg.date.strftime('%Y-%m-%d %H:%M')
-                    sender = await msg.get_sender()
+                    sender = await self.resolve_sender(msg)
                     sender_name = getattr(sender, 'first_name', 'Unknown') if sender else "Unknown"
 
                     # Check for keyword alerts
-                    alert_triggered = False
-                    if keywords:
-                        for keyword in keywords:
-                            if keyword.lower() in msg.text.lower():
-                                alert_triggered = True
-                                break
+                    matched = matcher.find(msg.text) if matcher else []
+                    alert_triggered = bool(matched)
+
+                    # Variants of confirmed spam floods skip the model
+                    cluster_id = self.dup_index.observe(event.chat_id, msg.id, msg.text)
+                    known_spam = self.dup_index.verdict(cluster_id)
 
                     # Analyze and send to Saved Messages
                     if alert_triggered or not keywords:
-                        analysis = await self.ai.analyze_content(
-                            f"[{timestamp}] {sender_name}: {msg.text}",
-                            custom_prompt="Quick intelligence assessment of this new message. Is it significant?"
-                        )
+                        if known_spam:
+                            analysis = f"🔁 {known_spam[2]} - assessment skipped"
+                        else:
+                            analysis = await self.ai.analyze_content(
+                                f"[{timestamp}] {sender_name}: {msg.text}",
+                                custom_prompt="Quick intelligence assessment of this new message. Is it significant?",
+                                priority=PRIORITY_MONITOR
+                            )
 
                         alert_msg = f"🚨 **ATLAS ALERT**\n"
                         alert_msg += f"**Source:** {chat_title}\n"
                         alert_msg += f"**Time:** {timestamp}\n"
                         if alert_triggered:
-                            alert_msg += f"**Keyword Match:** {', '.join(keywords)}\n"
+                            alert_msg += f"**Keyword Match:** {', '.join(matched)}\n"
                         alert_msg += f"\n**Message:**\n{msg.text}\n\n"
                         alert_msg += f"**AI Assessment:**\n{analysis}"
 
-                        await self.client.send_message('me', alert_msg)
+                        await self.outbound.send_message('me', alert_msg, priority=SEND_PRIORITY_ALERT)
 
-            self.monitoring_tasks[chat_title] = monitor_handler
+            if chat_title in self.monitoring_tasks:
+                self.router.remove(self.monitoring_tasks[chat_title])
+            self.monitoring_tasks[chat_title] = self.router.add(utils.get_peer_id(entity), 'monitor', monitor_handler)
             return f"✅ Now monitoring: {chat_title}" + (f" for keywords: {', '.join(keywords)}" if keywords else "")
 
         except Exception as e:
             logger.error(f"Monitoring Error: {e}")
             return f"❌ Monitoring Failed: {str(e)}"
 
-    async def send_long_message(self, target, content: str, parse_mode='html'):
-        """Send long messages by splitting them into multiple parts"""
+    async def send_long_message(self, target, content: str, parse_mode='html', priority=SEND_PRIORITY_REPLY):
+        """
+        Send long messages by splitting them into multiple parts.
+        Past REPORT_DOCUMENT_THRESHOLD the report goes out as a summary plus one document instead.
+        """
         max_length = 4000
         if len(content) <= max_length:
-            await self.client.send_message(target, content, parse_mode=parse_mode)
+            await self.outbound.send_message(target, content, parse_mode=parse_mode, priority=priority)
+            return
+
+        if 0 < REPORT_DOCUMENT_THRESHOLD < len(content):
+            await self.send_report_document(target, content, parse_mode, priority)
             return
 
         # Split into chunks
@@ -442,11 +3141,14 @@ class AtlasClient:
         if current_chunk:
             chunks.append(current_chunk)
 
-        # Send chunks
-        for i, chunk in enumerate(chunks, 1):
-            header = f"📄 **Part {i}/{len(chunks)}**\n\n" if len(chunks) > 1 else ""
-            await self.client.send_message(target, header + chunk, parse_mode=parse_mode)
-            await asyncio.sleep(0.5)  # Prevent flood
+        # Queue all parts at once; the outbound scheduler paces them and keeps their order
+        await asyncio.gather(*(
+            self.outbound.send_message(
+                target, (f"📄 **Part {i}/{len(chunks)}**\n\n" if len(chunks) > 1 else "") + chunk,
+                parse_mode=parse_mode, priority=priority
+            )
+            for i, chunk in enumerate(chunks, 1)
+        ))
 
     async def handle_command(self, event):
         """Enhanced Command Center with multiple command types"""
@@ -478,6 +3180,10 @@ class AtlasClient:
         elif msg_text.startswith(".stop"):
             await self.handle_stop_command(event)
 
+        # --- DIAGNOSTICS ---
+        elif msg_text.startswith(".stats"):
+            await self.handle_stats_command(event)
+
         # --- SEARCH COMMANDS ---
         elif msg_text.startswith(".global-search"):
             await self.handle_global_search_command(event)
@@ -527,27 +3233,37 @@ class AtlasClient:
     async def handle_atlas_command(self, event):
         """
         Standard analysis command with export options
-        Syntax: .atlas <target> [limit] [--media] [--entities] [--export json|csv|txt] [prompt]
+        Syntax: .atlas <target> [limit] [--since 24h | --between <start> <end>] [--media] [--entities]
+                [--refresh] [--no-cache] [--export json|csv|txt] [prompt]
         """
         msg_text = event.message.text
-        parts = msg_text.split()
+
+        try:
+            window, parts = self._parse_time_window(msg_text.split())
+        except ValueError as e:
+            await event.edit(f"❌ <b>Error:</b> {html.escape(str(e))}", parse_mode='html')
+            return
 
         if len(parts) < 2:
             await event.edit(
                 "<b>⚠️ ATLAS Usage:</b>\n"
-                "<code>.atlas &lt;target&gt; [limit] [--media] [--entities] [--export json|csv|txt] [prompt]</code>\n\n"
+                "<code>.atlas &lt;target&gt; [limit] [--since 24h | --between &lt;start&gt; &lt;end&gt;] [--media] [--entities] [--refresh] [--no-cache] [--export json|csv|txt] [prompt]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.atlas @channel 100</code>\n"
                 "<code>.atlas @channel 50 --media --entities</code>\n"
+                "<code>.atlas @channel --since 24h</code>\n"
+                "<code>.atlas @channel --between 2025-01-01 2025-01-08</code>\n"
                 "<code>.atlas @channel --export json What are the key topics?</code>"
             , parse_mode='html')
             return
 
         # Parse arguments
         target = parts[1]
-        limit = 50
+        limit = None if window else 50
         include_media = '--media' in msg_text
         extract_entities = '--entities' in msg_text
+        refresh = '--refresh' in msg_text
+        use_cache = '--no-cache' not in msg_text
         export_format = None
         custom_prompt = None
 
@@ -570,7 +3286,7 @@ class AtlasClient:
             if skip_next:
                 skip_next = False
                 continue
-            if part in ['--media', '--entities']:
+            if part in ['--media', '--entities', '--refresh', '--no-cache']:
                 continue
             if part == '--export':
                 skip_next = True
@@ -589,7 +3305,7 @@ class AtlasClient:
         await event.edit(
             f"⚡ <b>ATLAS v2.0 ACTIVE</b>\n"
             f"🔭 Target: <code>{target}</code>\n"
-            f"📡 Scanning: {limit} messages\n"
+            f"📡 Scanning: {self._describe_scope(limit, window)}\n"
             f"{media_line}"
             f"{entity_line}"
             f"{export_line}"
@@ -597,10 +3313,12 @@ class AtlasClient:
         , parse_mode='html')
 
         # Fetch Phase
-        chat_title, history_data, raw_messages = await self.fetch_history(target, limit, include_media)
+        chat_title, history_data, raw_messages = await self.fetch_history(
+            target, limit, include_media, filters=window or None, refresh=refresh
+        )
 
         if not history_data or history_data.startswith("❌"):
-            await event.edit(f"<b>MISSION FAILED</b>\n{history_data}", parse_mode='html')
+            await event.edit(f"<b>MISSION FAILED</b>\n{history_data or '❌ No messages in that window.'}", parse_mode='html')
             return
 
         # Analysis Phase
@@ -610,7 +3328,7 @@ class AtlasClient:
             f"🧠 <i>AI Processing with Gemini 3 Pro...</i>"
         , parse_mode='html')
 
-        ai_report = await self.ai.analyze_content(history_data, custom_prompt, extract_entities)
+        ai_report = await self.ai.analyze_content(history_data, custom_prompt, extract_entities, use_cache=use_cache)
 
         # Export Phase
         if export_format:
@@ -620,7 +3338,7 @@ class AtlasClient:
             export_data = {
                 'timestamp': timestamp,
                 'target': chat_title,
-                'message_count': limit,
+                'message_count': len(raw_messages),
                 'analysis': ai_report,
                 'raw_data': history_data
             }
@@ -638,7 +3356,8 @@ class AtlasClient:
         # Report Phase
         report_header = f"🛡️ <b>ATLAS INTELLIGENCE REPORT</b>\n"
         report_header += f"<b>Source:</b> {chat_title}\n"
-        report_header += f"<b>Scope:</b> Last {limit} messages\n"
+        scope = self._describe_scope(limit, window)
+        report_header += f"<b>Scope:</b> {scope[0].upper()}{scope[1:]}\n"
         report_header += f"<b>Model:</b> Gemini 3 Pro\n\n"
 
         final_message = report_header + ai_report
@@ -650,51 +3369,66 @@ class AtlasClient:
     async def handle_watch_command(self, event):
         """
         Real-time monitoring command
-        Syntax: .watch <target> [keyword1,keyword2,...]
+        Syntax: .watch <target> [keyword1,keyword2,...] [--whole-words]
         """
-        parts = event.message.text.split(maxsplit=2)
+        msg_text = event.message.text
+        whole_words = '--whole-words' in msg_text
+        parts = msg_text.replace('--whole-words', '').split(maxsplit=2)
 
         if len(parts) < 2:
             await event.edit(
                 "<b>⚠️ WATCH Usage:</b>\n"
-                "<code>.watch &lt;target&gt; [keyword1,keyword2,...]</code>\n\n"
+                "<code>.watch &lt;target&gt; [keyword1,keyword2,...] [--whole-words]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.watch @channel</code>\n"
-                "<code>.watch @channel crypto,scam,urgent</code>"
+                "<code>.watch @channel crypto,scam,urgent</code>\n"
+                "<code>.watch @channel ton,sol --whole-words</code>"
             , parse_mode='html')
             return
 
         target = parts[1]
-        keywords = parts[2].split(',') if len(parts) > 2 else None
+        keywords = parts[2].strip().split(',') if len(parts) > 2 else None
 
         await event.edit("🔄 <i>Initializing monitoring system...</i>", parse_mode='html')
 
-        result = await self.monitor_channel(target, keywords)
+        result = await self.monitor_channel(target, keywords, whole_words)
         await event.edit(f"🛡️ **ATLAS MONITORING ACTIVE**\n{result}", parse_mode='md')
 
     async def handle_compare_command(self, event):
         """
         Multi-channel comparison command
-        Syntax: .compare <target1> <target2> [target3] [limit]
+        Syntax: .compare <target1> <target2> [target3] [limit] [--since 24h | --between <start> <end>]
+                [--refresh] [--no-cache]
         """
-        parts = event.message.text.split()
+        try:
+            window, parts = self._parse_time_window(event.message.text.split())
+        except ValueError as e:
+            await event.edit(f"❌ <b>Error:</b> {html.escape(str(e))}", parse_mode='html')
+            return
 
         if len(parts) < 3:
             await event.edit(
                 "<b>⚠️ COMPARE Usage:</b>\n"
-                "<code>.compare &lt;target1&gt; &lt;target2&gt; [target3] [limit]</code>\n\n"
-                "<b>Example:</b>\n"
-                "<code>.compare @channel1 @channel2 @channel3 50</code>"
+                "<code>.compare &lt;target1&gt; &lt;target2&gt; [target3] [limit] [--since 24h | --between &lt;start&gt; &lt;end&gt;] [--refresh] [--no-cache]</code>\n\n"
+                "<b>Examples:</b>\n"
+                "<code>.compare @channel1 @channel2 @channel3 50</code>\n"
+                "<code>.compare @channel1 @channel2 --since 7d</code>"
             , parse_mode='html')
             return
 
         # Extract targets and limit
         targets = []
-        limit = 50
+        limit = None if window else 50
+        refresh = False
+        use_cache = True
 
         for part in parts[1:]:
             if part.isdigit():
                 limit = int(part)
+            elif part == '--refresh':
+                refresh = True
+            elif part == '--no-cache':
+                use_cache = False
             else:
                 targets.append(part)
 
@@ -711,7 +3445,9 @@ class AtlasClient:
         # Fetch all channel data
         channel_data_list = []
         for target in targets:
-            chat_title, history_data, _ = await self.fetch_history(target, limit)
+            chat_title, history_data, _ = await self.fetch_history(
+                target, limit, filters=window or None, refresh=refresh
+            )
             if history_data and not history_data.startswith("❌"):
                 channel_data_list.append((chat_title, history_data))
 
@@ -720,35 +3456,198 @@ class AtlasClient:
             return
 
         # Comparative analysis
-        comparison_report = await self.ai.compare_channels(channel_data_list)
+        comparison_report = await self.ai.compare_channels(channel_data_list, use_cache=use_cache)
 
         report_header = f"🛡️ <b>ATLAS COMPARATIVE INTELLIGENCE</b>\n"
         report_header += f"<b>Channels:</b> {', '.join([name for name, _ in channel_data_list])}\n"
-        report_header += f"<b>Scope:</b> {limit} messages per channel\n\n"
+        if window:
+            scope = self._describe_scope(limit, window)
+            report_header += f"<b>Scope:</b> {scope[0].upper()}{scope[1:]}\n\n"
+        else:
+            report_header += f"<b>Scope:</b> {limit} messages per channel\n\n"
 
         final_message = report_header + comparison_report
 
         await event.delete()
         await self.send_long_message('me', final_message, parse_mode='html')
 
+    @staticmethod
+    def _render_report(content: str, parse_mode) -> Tuple[bytes, str, str]:
+        """Render a report for upload; returns (data, extension, plain text)"""
+        is_html = parse_mode == 'html'
+        plain = html.unescape(re.sub(r'<[^>]+>', '', content)) if is_html else content
+        fmt = REPORT_DOCUMENT_FORMAT
+        if fmt == 'auto':
+            fmt = 'html' if is_html else 'md'
+
+        if fmt == 'html':
+            body = content if is_html else html.escape(content)
+            document = (
+                "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Atlas Report</title></head>\n"
+                "<body style=\"white-space: pre-wrap; font-family: sans-serif; max-width: 60em; margin: auto\">\n"
+                f"{body}\n</body></html>\n"
+            )
+        elif fmt == 'md' and not is_html:
+            document = content
+        else:
+            fmt = 'txt'
+            document = plain
+        return document.encode('utf-8'), fmt, plain
+
+    async def send_report_document(self, target, content: str, parse_mode='html', priority=SEND_PRIORITY_REPLY):
+        """Deliver a long report as an inline summary plus a single in-memory document upload"""
+        data, extension, plain = self._render_report(content, parse_mode)
+
+        # Summary: leading lines of the plain-text report, cut on a line boundary
+        excerpt = plain[:REPORT_SUMMARY_CHARS]
+        if len(plain) > REPORT_SUMMARY_CHARS and '\n' in excerpt:
+            excerpt = excerpt.rsplit('\n', 1)[0]
+        excerpt = excerpt.strip()
+
+        filename = f"atlas_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        summary = f"{html.escape(excerpt)}\n\n<i>… full report ({len(plain):,} chars) attached as {filename}</i>"
+        await self.outbound.send_message(target, summary, parse_mode='html', priority=priority)
+        # Raw bytes (not a stream) so a FloodWait retry re-uploads the full file
+        await self.outbound.call(
+            self.client.send_file, target, data, priority=priority, force_document=True,
+            attributes=[DocumentAttributeFilename(filename)]
+        )
+
     async def handle_export_command(self, event):
         """Quick export of last analysis"""
         await event.edit("💡 <b>Tip:</b> Use <code>.atlas &lt;target&gt; --export json</code> to export during analysis", parse_mode='html')
 
     async def handle_stop_command(self, event):
-        """Stop all monitoring tasks"""
-        if not self.monitoring_tasks:
-            await event.edit("❌ No active monitoring tasks", parse_mode='html')
+        """
+        Stop active rules
+        Syntax: .stop [watch|forward|auto-mod|all] (default: watch)
+        """
+        parts = event.message.text.split()
+        scope = parts[1] if len(parts) > 1 else 'watch'
+        if scope not in ('watch', 'forward', 'auto-mod', 'all'):
+            await event.edit(
+                "<b>⚠️ STOP Usage:</b>\n"
+                "<code>.stop [watch|forward|auto-mod|all]</code>"
+            , parse_mode='html')
+            return
+
+        stopped = []
+        if scope in ('watch', 'all') and self.monitoring_tasks:
+            stopped.append(f"{self.router.remove_kind('monitor')} monitoring task(s)")
+            self.monitoring_tasks.clear()
+        if scope in ('forward', 'all') and self.auto_forward_rules:
+            stopped.append(f"{self.router.remove_kind('forward')} auto-forward rule(s)")
+            self.auto_forward_rules.clear()
+        if scope in ('auto-mod', 'all') and self.auto_mod_rules:
+            stopped.append(f"{self.router.remove_kind('auto-mod')} auto-mod rule(s)")
+            self.auto_mod_rules.clear()
+
+        if not stopped:
+            await event.edit("❌ No active rules to stop", parse_mode='html')
             return
 
-        count = len(self.monitoring_tasks)
-        self.monitoring_tasks.clear()
-        await event.edit(f"✅ Stopped {count} monitoring task(s)", parse_mode='html')
+        await event.edit(f"✅ Stopped {', '.join(stopped)}", parse_mode='html')
+
+    async def handle_stats_command(self, event):
+        """Show cache and pipeline counters"""
+        sender_stats = self.sender_cache.stats()
+
+        report = f"📈 <b>ATLAS STATS</b>\n\n"
+        report += f"<b>Sender Cache:</b>\n"
+        report += f"• Entries: {sender_stats['size']}/{sender_stats['max_size']}\n"
+        report += f"• Hits: {sender_stats['hits']} | Misses: {sender_stats['misses']}\n"
+        report += f"• Hit Rate: {sender_stats['hit_rate']*100:.1f}%\n"
+        report += f"• Evictions: {sender_stats['evictions']}\n\n"
+
+        archive_stats = await asyncio.to_thread(self.archive.stats)
+        report += f"<b>Message Archive:</b>\n"
+        report += f"• Chats: {archive_stats['chats']}\n"
+        report += f"• Messages: {archive_stats['messages']}\n\n"
+
+        media_stats = await asyncio.to_thread(self.media_cache.stats)
+        report += f"<b>Media Analysis Cache:</b>\n"
+        report += f"• Entries: {media_stats['entries']}/{media_stats['max_entries']}\n"
+        report += f"• File-id Hits: {media_stats['file_hits']} | Content Hits: {media_stats['content_hits']} | Misses: {media_stats['misses']}\n"
+        report += f"• Model Calls Saved: {media_stats['saved_calls']} | Downloads Saved: {media_stats['saved_downloads']}\n\n"
+
+        report += f"<b>LLM Response Cache:</b>\n"
+        if self.ai.cache:
+            llm_stats = await asyncio.to_thread(self.ai.cache.stats)
+            report += f"• Entries: {llm_stats['entries']} ({llm_stats['bytes'] / 1024 / 1024:.1f}/{llm_stats['max_bytes'] / 1024 / 1024:.0f} MB)\n"
+            report += f"• Hits: {llm_stats['hits']} | Misses: {llm_stats['misses']} | Expired: {llm_stats['expired']}\n"
+            report += f"• Hit Rate: {llm_stats['hit_rate']*100:.1f}%\n"
+        else:
+            report += "• Disabled (ATLAS_LLM_CACHE=0)\n"
+
+        if self.ai.spam_filter:
+            spam_stats = self.ai.spam_filter.stats()
+            report += f"\n<b>Spam Pre-filter:</b>\n"
+            report += f"• Settled Spam: {spam_stats['settled_spam']} | Settled Clean: {spam_stats['settled_ham']} | Escalated: {spam_stats['escalated']}\n"
+            report += f"• Model Calls Avoided: {spam_stats['avoided_rate']*100:.1f}% | Blocked Domains: {spam_stats['blocked_domains']}\n"
+
+        if self.auto_forward_rules:
+            report += f"\n<b>Auto-forward:</b>\n"
+            for rule in self.auto_forward_rules:
+                avg_latency = rule['latency_total'] / rule['count'] if rule['count'] else 0.0
+                report += (
+                    f"• {rule['source_name']} → {rule['dest_name']}: forwarded {rule['count']}, queued {rule['pending']}, "
+                    f"failed {rule['failed']}, flood waits {rule['flood_waits']}, "
+                    f"latency avg {avg_latency:.1f}s / max {rule['latency_max']:.1f}s\n"
+                )
+
+        outbound_stats = self.outbound.stats()
+        report += f"\n<b>Outbound Sends:</b>\n"
+        report += f"• Rate: {outbound_stats['rate']:.0f}/{outbound_stats['max_rate']:.0f} per min | Flood Waits: {outbound_stats['flood_waits']} | Failed: {outbound_stats['failed']}\n"
+        for lane, lane_stats in outbound_stats['lanes'].items():
+            report += f"• {lane}: queued {lane_stats['queued']}, sent {lane_stats['sent']}, wait avg {lane_stats['avg_wait']:.1f}s\n"
+
+        edit_stats = self.edit_history.stats()
+        report += f"\n<b>Event Monitors:</b>\n"
+        report += f"• Watched Chats: {len(self.event_monitors)}\n"
+        report += f"• Edit History: {edit_stats['messages']} message(s) in {edit_stats['chats']} chat(s) | Evictions: {edit_stats['evictions']}\n"
+        buffer_stats = self.message_buffer.stats()
+        report += f"• Delete Buffer: {buffer_stats['messages']} message(s), {buffer_stats['bytes'] / 1024:.0f} KB in {buffer_stats['chats']} chat(s){' (+disk spill)' if buffer_stats['spill'] else ''}\n"
+        report += f"• Deleted Content Recovered: {buffer_stats['recovered']} | Unrecoverable: {buffer_stats['missed']}\n"
+
+        job_stats = self.jobs.stats()
+        next_run = datetime.fromtimestamp(job_stats['next_run']).strftime('%Y-%m-%d %H:%M') if job_stats['next_run'] else '-'
+        report += f"\n<b>Scheduled Jobs:</b>\n"
+        report += f"• Jobs: {job_stats['jobs']} | Running: {job_stats['running']} | Next: {next_run}\n"
+        report += f"• Runs: {job_stats['runs']} | Failed: {job_stats['failures']} | Skipped Overlaps: {job_stats['skipped_overlaps']}\n"
+
+        router_stats = self.router.stats()
+        report += f"\n<b>Message Router:</b>\n"
+        report += f"• Chats: {router_stats['chats']} | Dispatched: {router_stats['dispatched']}\n"
+        report += f"• Rules: " + ", ".join(f"{kind} {count}" for kind, count in router_stats['rules'].items()) + "\n"
+
+        reputation_stats = self.reputation.stats()
+        report += f"\n<b>Sender Reputation:</b>\n"
+        report += f"• Senders: {reputation_stats['senders']} (bad: {reputation_stats['bad']}, trusted: {reputation_stats['trusted']})\n"
+        report += f"• Actioned Without AI: {reputation_stats['actioned_bad']} | Trusted Skips: {reputation_stats['skipped_trusted']}\n"
+
+        dup_stats = self.dup_index.stats()
+        report += f"\n<b>Near-duplicate Index:</b>\n"
+        report += f"• Window: {dup_stats['entries']}/{dup_stats['max_entries']} | Clusters: {dup_stats['clusters']} (spam: {dup_stats['spam_clusters']}, largest: {dup_stats['largest']})\n"
+        report += f"• Verdicts Propagated: {dup_stats['propagated']}\n"
+
+        scheduler_stats = self.ai.scheduler.stats()
+        report += f"\n<b>Gemini Scheduler:</b>\n"
+        report += f"• Running: {scheduler_stats['running']}/{scheduler_stats['concurrency']} | Retries: {scheduler_stats['retries']}\n"
+        for lane, lane_stats in scheduler_stats['lanes'].items():
+            report += (
+                f"• {lane}: queued {lane_stats['queued']}, done {lane_stats['completed']}, "
+                f"dropped {lane_stats['dropped']}, wait avg {lane_stats['avg_wait']:.1f}s / max {lane_stats['max_wait']:.1f}s\n"
+            )
+
+        await event.edit(report, parse_mode='html')
 
     async def handle_search_command(self, event):
         """
         Search messages with filters
-        Syntax: .search <target> <keyword> [--from @user] [--regex pattern] [--after YYYY-MM-DD] [--limit N]
+        Syntax: .search <target> <keyword> [--from @user] [--regex pattern] [--after YYYY-MM-DD]
+                [--before YYYY-MM-DD] [--type photos|videos|documents|voice|music|gifs|links] [--limit N] [--network]
+        Archived chats are searched through the local full-text index unless --network is given
+        or the archived range doesn't reach back far enough to cover the search.
         """
         msg_text = event.message.text
         parts = msg_text.split()
@@ -756,12 +3655,13 @@ class AtlasClient:
         if len(parts) < 3:
             await event.edit(
                 "<b>⚠️ SEARCH Usage:</b>\n"
-                "<code>.search &lt;target&gt; &lt;keyword&gt; [--from @user] [--regex pattern] [--after YYYY-MM-DD] [--limit N]</code>\n\n"
+                "<code>.search &lt;target&gt; &lt;keyword&gt; [--from @user] [--regex pattern] [--after YYYY-MM-DD] [--before YYYY-MM-DD] [--type photos|videos|documents|voice|music|gifs|links] [--limit N] [--network]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.search @channel crypto</code>\n"
                 "<code>.search @channel bitcoin --from @john</code>\n"
                 "<code>.search @channel --regex \"\\d{3}-\\d{3}-\\d{4}\"</code>\n"
-                "<code>.search @channel scam --after 2025-01-01 --limit 100</code>"
+                "<code>.search @channel scam --after 2025-01-01 --limit 100</code>\n"
+                "<code>.search @channel --type photos --from @john</code>"
             , parse_mode='html')
             return
 
@@ -782,16 +3682,19 @@ class AtlasClient:
                 i += 2
             elif parts[i] == '--after' and i + 1 < len(parts):
                 try:
-                    filters['after_date'] = datetime.strptime(parts[i + 1], '%Y-%m-%d')
+                    filters['after_date'] = datetime.strptime(parts[i + 1], '%Y-%m-%d').replace(tzinfo=timezone.utc)
                     i += 2
                 except:
                     i += 1
             elif parts[i] == '--before' and i + 1 < len(parts):
                 try:
-                    filters['before_date'] = datetime.strptime(parts[i + 1], '%Y-%m-%d')
+                    filters['before_date'] = datetime.strptime(parts[i + 1], '%Y-%m-%d').replace(tzinfo=timezone.utc)
                     i += 2
                 except:
                     i += 1
+            elif parts[i] == '--type' and i + 1 < len(parts) and parts[i + 1] in SEARCH_MEDIA_FILTERS:
+                filters['media_type'] = parts[i + 1]
+                i += 2
             elif parts[i] == '--limit' and i + 1 < len(parts):
                 try:
                     limit = int(parts[i + 1])
@@ -806,15 +3709,42 @@ class AtlasClient:
 
         await event.edit(f"🔍 <b>SEARCHING...</b>\n<code>{target}</code>", parse_mode='html')
 
-        # Fetch with filters
-        chat_title, filtered_data, raw_messages = await self.fetch_history(target, limit, filters=filters)
+        # Archived chats answer keyword searches from the local index
+        use_index = 'keyword' in filters and 'media_type' not in filters and '--network' not in parts
 
-        if not filtered_data or filtered_data.startswith("❌"):
-            await event.edit(f"<b>SEARCH FAILED</b>\n{filtered_data}", parse_mode='html')
+        result_lines = []
+        result_count = 0
+        index_facets = None
+        try:
+            entity, chat_title = await self.resolve_target(target)
+            chat_id = utils.get_peer_id(entity)
+
+            if use_index and chat_id in self.archive.chat_ids:
+                await self._catch_up_archive(entity, chat_title)
+                # A partial archive (e.g. from a short .atlas scan) would silently miss older history
+                use_index = await self._archive_covers(entity, chat_id, filters.get('after_date'))
+                if not use_index:
+                    logger.info(f"Archive for {chat_title} does not cover the search scope; searching Telegram")
+
+            if use_index and chat_id in self.archive.chat_ids:
+                results, index_facets = await asyncio.to_thread(
+                    self.archive.search, filters['keyword'], [chat_id],
+                    filters['from_user'].lstrip('@') if 'from_user' in filters else None,
+                    filters.get('after_date'), filters.get('before_date'), limit, filters.get('regex')
+                )
+                result_count = len(results)
+                result_lines = [f"[{m['timestamp']}] {m['sender_name']}: {m['text']}" for m in results]
+            else:
+                # Stream matches batch by batch, keeping only the formatted lines
+                async for batch in self.iter_history_batches(entity, chat_title, limit, filters=filters):
+                    result_count += len(batch)
+                    result_lines.extend(
+                        f"[{m['timestamp']}] {m['sender_name']}: {m['text']}" for m in batch if m['text']
+                    )
+        except Exception as e:
+            await event.edit(f"<b>SEARCH FAILED</b>\n{self._describe_fetch_error(e)}", parse_mode='html')
             return
 
-        result_count = len(raw_messages)
-
         if result_count == 0:
             await event.edit("❌ <b>No messages found matching your criteria</b>", parse_mode='html')
             return
@@ -827,8 +3757,14 @@ class AtlasClient:
             report += f"<b>Keyword:</b> {filters['keyword']}\n"
         if 'from_user' in filters:
             report += f"<b>From:</b> {filters['from_user']}\n"
+        if 'media_type' in filters:
+            report += f"<b>Type:</b> {filters['media_type']}\n"
+        if index_facets:
+            report += f"<b>Index:</b> local archive, {index_facets['total']} total match(es), ranked by relevance\n"
+            if index_facets['senders']:
+                report += f"<b>Top Senders:</b> {', '.join(f'{name} ({n})' for name, n in index_facets['senders'])}\n"
         report += "\n" + "="*40 + "\n\n"
-        report += filtered_data
+        report += "\n".join(result_lines)
 
         await event.delete()
         await self.send_long_message('me', report, parse_mode='html')
@@ -836,7 +3772,7 @@ class AtlasClient:
     async def handle_profile_command(self, event):
         """
         Analyze a specific user's activity in a channel
-        Syntax: .profile @username in <target> [limit]
+        Syntax: .profile @username in <target> [limit] [--refresh] [--no-cache]
         """
         msg_text = event.message.text
         parts = msg_text.split()
@@ -844,7 +3780,7 @@ class AtlasClient:
         if len(parts) < 4 or parts[2] != 'in':
             await event.edit(
                 "<b>⚠️ PROFILE Usage:</b>\n"
-                "<code>.profile @username in &lt;target&gt; [limit]</code>\n\n"
+                "<code>.profile @username in &lt;target&gt; [limit] [--refresh] [--no-cache]</code>\n\n"
                 "<b>Example:</b>\n"
                 "<code>.profile @john in @channel 500</code>"
             , parse_mode='html')
@@ -853,19 +3789,21 @@ class AtlasClient:
         username = parts[1].lstrip('@')
         target = parts[3]
         limit = int(parts[4]) if len(parts) > 4 and parts[4].isdigit() else 1000
+        refresh = '--refresh' in parts
+        use_cache = '--no-cache' not in parts
 
         await event.edit(f"👤 <b>ANALYZING USER PROFILE...</b>\n<code>@{username}</code> in <code>{target}</code>", parse_mode='html')
 
-        # Fetch messages
-        chat_title, history_data, raw_messages = await self.fetch_history(target, limit)
-
-        if not history_data or history_data.startswith("❌"):
-            await event.edit(f"<b>PROFILE FAILED</b>\n{history_data}", parse_mode='html')
+        # Stream the history, keeping only this user's messages
+        user_messages = []
+        try:
+            entity, chat_title = await self.resolve_target(target)
+            async for batch in self.iter_history_batches(entity, chat_title, limit, refresh=refresh):
+                user_messages.extend(msg for msg in batch if msg['sender_username'] == username)
+        except Exception as e:
+            await event.edit(f"<b>PROFILE FAILED</b>\n{self._describe_fetch_error(e)}", parse_mode='html')
             return
 
-        # Filter messages by user
-        user_messages = [msg for msg in raw_messages if msg['sender_username'] == username]
-
         if not user_messages:
             await event.edit(f"❌ <b>No messages found from @{username} in {chat_title}</b>", parse_mode='html')
             return
@@ -897,7 +3835,7 @@ User: @{username}
 Messages analyzed: {message_count}
 """
 
-        ai_analysis = await self.ai.analyze_content(user_text[:10000], analysis_prompt)  # Limit context
+        ai_analysis = await self.ai.analyze_content(user_text, analysis_prompt, use_cache=use_cache)
 
         # Build report
         report = f"👤 <b>USER PROFILE: @{username}</b>\n\n"
@@ -919,14 +3857,14 @@ Messages analyzed: {message_count}
     async def handle_export_raw_command(self, event):
         """
         Export raw message data without AI analysis
-        Syntax: .export-raw <target> [limit] [--format json|csv]
+        Syntax: .export-raw <target> [limit] [--format json|csv] [--refresh]
         """
         parts = event.message.text.split()
 
         if len(parts) < 2:
             await event.edit(
                 "<b>⚠️ EXPORT-RAW Usage:</b>\n"
-                "<code>.export-raw &lt;target&gt; [limit] [--format json|csv]</code>\n\n"
+                "<code>.export-raw &lt;target&gt; [limit] [--format json|csv] [--refresh]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.export-raw @channel 1000</code>\n"
                 "<code>.export-raw @channel 500 --format csv</code>"
@@ -936,6 +3874,7 @@ Messages analyzed: {message_count}
         target = parts[1]
         limit = 500
         export_format = 'json'
+        refresh = '--refresh' in parts
 
         # Parse arguments
         for i, part in enumerate(parts[2:], 2):
@@ -946,66 +3885,62 @@ Messages analyzed: {message_count}
 
         await event.edit(f"💾 <b>EXPORTING RAW DATA...</b>\n<code>{target}</code>", parse_mode='html')
 
-        # Fetch data
-        chat_title, history_data, raw_messages = await self.fetch_history(target, limit)
+        # Stream batches straight to disk
+        writer = None
+        try:
+            entity, chat_title = await self.resolve_target(target)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"raw_{chat_title.replace(' ', '_')}_{timestamp}"
+            writer = RawMessageWriter(filename, export_format)
 
-        if not history_data or history_data.startswith("❌"):
-            await event.edit(f"<b>EXPORT FAILED</b>\n{history_data}", parse_mode='html')
+            async for batch in self.iter_history_batches(entity, chat_title, limit, refresh=refresh):
+                writer.write_batch(batch)
+        except Exception as e:
+            await event.edit(f"<b>EXPORT FAILED</b>\n{self._describe_fetch_error(e)}", parse_mode='html')
             return
+        finally:
+            if writer:
+                writer.close(chat_title)
 
-        # Export
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"raw_{chat_title.replace(' ', '_')}_{timestamp}"
-
-        if export_format == 'json':
-            filepath = self.export_handler.export_json({'messages': raw_messages, 'source': chat_title, 'count': len(raw_messages)}, filename)
-        else:  # csv
-            # Flatten for CSV
-            csv_data = []
-            for msg in raw_messages:
-                csv_data.append({
-                    'timestamp': msg['timestamp'],
-                    'sender_name': msg['sender_name'],
-                    'sender_username': msg['sender_username'],
-                    'message': msg['text']
-                })
-            filepath = EXPORTS_DIR / f"{filename}.csv"
-            with open(filepath, 'w', newline='', encoding='utf-8') as f:
-                if csv_data:
-                    writer = csv.DictWriter(f, fieldnames=csv_data[0].keys())
-                    writer.writeheader()
-                    writer.writerows(csv_data)
-
-        await event.edit(f"✅ <b>EXPORTED</b>\n<code>{filepath}</code>\n<b>Messages:</b> {len(raw_messages)}", parse_mode='html')
+        await event.edit(f"✅ <b>EXPORTED</b>\n<code>{writer.filepath}</code>\n<b>Messages:</b> {writer.count}", parse_mode='html')
 
     async def handle_translate_command(self, event):
         """
         Analyze channel with translation
-        Syntax: .translate <target> <language> [limit]
+        Syntax: .translate <target> <language> [limit] [--since 24h | --between <start> <end>] [--refresh] [--no-cache]
         """
-        parts = event.message.text.split()
+        try:
+            window, parts = self._parse_time_window(event.message.text.split())
+        except ValueError as e:
+            await event.edit(f"❌ <b>Error:</b> {html.escape(str(e))}", parse_mode='html')
+            return
 
         if len(parts) < 3:
             await event.edit(
                 "<b>⚠️ TRANSLATE Usage:</b>\n"
-                "<code>.translate &lt;target&gt; &lt;language&gt; [limit]</code>\n\n"
+                "<code>.translate &lt;target&gt; &lt;language&gt; [limit] [--since 24h | --between &lt;start&gt; &lt;end&gt;] [--refresh] [--no-cache]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.translate @russian_channel english 100</code>\n"
-                "<code>.translate @chinese_channel en 200</code>"
+                "<code>.translate @chinese_channel en 200</code>\n"
+                "<code>.translate @russian_channel english --since 24h</code>"
             , parse_mode='html')
             return
 
         target = parts[1]
         language = parts[2]
-        limit = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 100
+        limit = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else (None if window else 100)
+        refresh = '--refresh' in parts
+        use_cache = '--no-cache' not in parts
 
         await event.edit(f"🌐 <b>TRANSLATING & ANALYZING...</b>\n<code>{target}</code> → {language}", parse_mode='html')
 
         # Fetch data
-        chat_title, history_data, raw_messages = await self.fetch_history(target, limit)
+        chat_title, history_data, raw_messages = await self.fetch_history(
+            target, limit, filters=window or None, refresh=refresh
+        )
 
         if not history_data or history_data.startswith("❌"):
-            await event.edit(f"<b>TRANSLATION FAILED</b>\n{history_data}", parse_mode='html')
+            await event.edit(f"<b>TRANSLATION FAILED</b>\n{history_data or '❌ No messages in that window.'}", parse_mode='html')
             return
 
         # AI analysis with translation
@@ -1020,13 +3955,15 @@ Provide:
 Original content below:
 """
 
-        ai_report = await self.ai.analyze_content(history_data, translation_prompt)
+        ai_report = await self.ai.analyze_content(history_data, translation_prompt, use_cache=use_cache)
 
         report = f"🌐 <b>TRANSLATED ANALYSIS</b>\n"
         report += f"<b>Source:</b> {chat_title}\n"
         report += f"<b>Language:</b> {language}\n"
-        report += f"<b>Messages:</b> {limit}\n\n"
-        report += ai_report
+        report += f"<b>Messages:</b> {len(raw_messages)}\n"
+        if window:
+            report += f"<b>Window:</b> {self._describe_scope(limit, window).replace('messages ', '', 1)}\n"
+        report += "\n" + ai_report
 
         await event.delete()
         await self.send_long_message('me', report, parse_mode='html')
@@ -1036,7 +3973,7 @@ Original content below:
     async def handle_auto_forward_command(self, event):
         """
         Auto-forwarding from source to destination with filters
-        Syntax: .auto-forward from <source> to <destination> [--filter keyword1,keyword2] [--media-only]
+        Syntax: .auto-forward from <source> to <destination> [--filter keyword1,keyword2] [--whole-words] [--media-only]
         """
         msg_text = event.message.text
         parts = msg_text.split()
@@ -1044,7 +3981,7 @@ Original content below:
         if len(parts) < 5 or 'from' not in msg_text or 'to' not in msg_text:
             await event.edit(
                 "<b>⚠️ AUTO-FORWARD Usage:</b>\n"
-                "<code>.auto-forward from &lt;source&gt; to &lt;destination&gt; [--filter keywords] [--media-only]</code>\n\n"
+                "<code>.auto-forward from &lt;source&gt; to &lt;destination&gt; [--filter keywords] [--whole-words] [--media-only]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.auto-forward from @channel1 to @channel2</code>\n"
                 "<code>.auto-forward from @intel_source to me --filter crypto,urgent</code>\n"
@@ -1082,12 +4019,21 @@ Original content below:
                 'source_name': source_title,
                 'dest_name': dest_title,
                 'keywords': keywords,
+                'matcher': KeywordMatcher(keywords, '--whole-words' in parts) if keywords else None,
                 'media_only': media_only,
-                'count': 0
+                'count': 0,
+                'pending': 0,
+                'failed': 0,
+                'flood_waits': 0,
+                'latency_total': 0.0,
+                'latency_max': 0.0
             }
 
-            # Register handler
-            @self.client.on(events.NewMessage(chats=source_entity))
+            dest_id = utils.get_peer_id(dest_entity)
+            if dest_id not in self.forward_queues:
+                self.forward_queues[dest_id] = ForwardQueue(self.client, dest_entity, dest_title)
+            forward_queue = self.forward_queues[dest_id]
+
             async def forward_handler(event):
                 msg = event.message
 
@@ -1097,19 +4043,14 @@ Original content below:
                 if rule['media_only'] and not msg.media:
                     should_forward = False
 
-                if rule['keywords'] and msg.text:
-                    keyword_match = any(kw.lower() in msg.text.lower() for kw in rule['keywords'])
-                    if not keyword_match:
+                if rule['matcher'] and msg.text:
+                    if not rule['matcher'].matches(msg.text):
                         should_forward = False
 
                 if should_forward:
-                    try:
-                        await self.client.forward_messages(rule['destination'], msg)
-                        rule['count'] += 1
-                        logger.info(f"Auto-forwarded message from {rule['source_name']} to {rule['dest_name']}")
-                    except Exception as e:
-                        logger.error(f"Auto-forward failed: {e}")
+                    forward_queue.enqueue(msg, rule)
 
+            rule['rule_id'] = self.router.add(utils.get_peer_id(source_entity), 'forward', forward_handler)
             self.auto_forward_rules.append(rule)
 
             filter_text = f" (Filter: {', '.join(keywords)})" if keywords else ""
@@ -1156,13 +4097,31 @@ Original content below:
             entity = await self.client.get_entity(target)
             target_name = getattr(entity, 'title', getattr(entity, 'username', target))
 
-            self.event_monitors[target_name] = {
+            chat_id = utils.get_peer_id(entity)
+            previous = self.event_monitors.get(chat_id)
+            if previous and previous.get('capture_rule') is not None:
+                self.router.remove(previous['capture_rule'])
+
+            # Keep recent content around so deletions can be reported with what was removed
+            capture_rule = None
+            if watch_deletes:
+                async def capture_handler(event):
+                    await self._capture_message(event.chat_id, event.message)
+
+                capture_rule = self.router.add(chat_id, 'capture', capture_handler)
+            else:
+                self.message_buffer.drop_chat(chat_id)
+
+            # Keyed by marked chat id so edit/delete events are routed with one lookup
+            self.event_monitors[chat_id] = {
+                'name': target_name,
                 'entity': entity,
                 'edits': watch_edits,
                 'deletes': watch_deletes,
                 'online': watch_online,
                 'edit_count': 0,
-                'delete_count': 0
+                'delete_count': 0,
+                'capture_rule': capture_rule
             }
 
             features = []
@@ -1183,59 +4142,109 @@ Original content below:
         except Exception as e:
             await event.edit(f"❌ <b>Event monitoring failed:</b> {str(e)}", parse_mode='html')
 
+    async def _capture_message(self, chat_id: int, msg):
+        """Store a message in the ring buffer; sender names come from already-known entities only"""
+        sender = msg.sender or self.sender_cache.get(msg.sender_id)
+        sender_name = (getattr(sender, 'first_name', None) or getattr(sender, 'title', None) or '') if sender else ''
+        media_ref = None
+        if msg.media:
+            media_ref = MediaAnalysisCache.file_key(msg) or type(msg.media).__name__
+        self.message_buffer.put(
+            chat_id, msg.id, int(msg.date.timestamp()), msg.sender_id, sender_name, msg.text, media_ref
+        )
+        if self.message_buffer.spill_due():
+            await asyncio.to_thread(self.message_buffer.flush_spill)
+
     async def handle_message_edit(self, event):
         """Handle message edit events"""
-        for monitor_name, monitor in self.event_monitors.items():
-            if monitor['edits']:
-                try:
-                    if event.chat_id == monitor['entity'].id:
-                        msg = event.message
-                        sender = await msg.get_sender()
-                        sender_name = getattr(sender, 'first_name', 'Unknown') if sender else "Unknown"
-
-                        # Track edit
-                        msg_id = msg.id
-                        if msg_id not in self.edited_messages_cache:
-                            self.edited_messages_cache[msg_id] = []
+        monitor = self.event_monitors.get(event.chat_id)
+        if not monitor:
+            return
+        if monitor['deletes']:
+            await self._capture_message(event.chat_id, event.message)
+        if not monitor['edits']:
+            return
 
-                        self.edited_messages_cache[msg_id].append({
-                            'timestamp': datetime.now(),
-                            'text': msg.text
-                        })
+        try:
+            msg = event.message
+            sender = await self.resolve_sender(msg)
+            sender_name = getattr(sender, 'first_name', 'Unknown') if sender else "Unknown"
 
-                        monitor['edit_count'] += 1
+            # Track edit
+            edit_number = self.edit_history.record(event.chat_id, msg.id, msg.text)
+            monitor['edit_count'] += 1
 
-                        alert = f"✏️ <b>MESSAGE EDITED</b>\n"
-                        alert += f"<b>Channel:</b> {monitor_name}\n"
-                        alert += f"<b>Sender:</b> {sender_name}\n"
-                        alert += f"<b>Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                        alert += f"<b>New Text:</b>\n{msg.text[:500]}\n"
+            alert = f"✏️ <b>MESSAGE EDITED</b>\n"
+            alert += f"<b>Channel:</b> {monitor['name']}\n"
+            alert += f"<b>Sender:</b> {sender_name}\n"
+            alert += f"<b>Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            alert += f"<b>New Text:</b>\n{msg.text[:500]}\n"
 
-                        if len(self.edited_messages_cache[msg_id]) > 1:
-                            alert += f"\n<b>Edit #{len(self.edited_messages_cache[msg_id])}</b>"
+            if edit_number > 1:
+                alert += f"\n<b>Edit #{edit_number}</b>"
 
-                        await self.client.send_message('me', alert, parse_mode='html')
-                except Exception as e:
-                    logger.error(f"Edit event handling failed: {e}")
+            await self.outbound.send_message('me', alert, parse_mode='html', priority=SEND_PRIORITY_ALERT)
+        except Exception as e:
+            logger.error(f"Edit event handling failed: {e}")
 
     async def handle_message_delete(self, event):
         """Handle message delete events"""
-        for monitor_name, monitor in self.event_monitors.items():
-            if monitor['deletes']:
-                try:
-                    # Note: Telethon doesn't provide full context for deleted messages
-                    # We can only know that messages were deleted, not their content
-                    monitor['delete_count'] += 1
-
-                    alert = f"🗑️ <b>MESSAGE(S) DELETED</b>\n"
-                    alert += f"<b>Channel:</b> {monitor_name}\n"
-                    alert += f"<b>Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                    alert += f"<b>Deleted Message IDs:</b> {event.deleted_ids}\n"
-                    alert += f"\n<i>⚠️ Original content not recoverable</i>"
-
-                    await self.client.send_message('me', alert, parse_mode='html')
-                except Exception as e:
-                    logger.error(f"Delete event handling failed: {e}")
+        if event.chat_id is not None:
+            monitor = self.event_monitors.get(event.chat_id)
+            targets = {event.chat_id: event.deleted_ids} if monitor and monitor['deletes'] else {}
+        else:
+            # Private chats and basic groups: Telegram omits the chat, but their message ids
+            # are account-wide, so attribute them through what we have on record
+            candidates = [
+                chat_id for chat_id, monitor in self.event_monitors.items()
+                if monitor['deletes'] and not isinstance(monitor['entity'], Channel)
+            ]
+            targets = defaultdict(list)
+            if candidates:
+                for source in (self.message_buffer, self.edit_history):
+                    for chat_id, ids in source.locate(event.deleted_ids, candidates).items():
+                        targets[chat_id].extend(i for i in ids if i not in targets[chat_id])
+
+                # Entries evicted to the spill table are no longer in memory
+                attributed = {i for ids in targets.values() for i in ids}
+                unattributed = [i for i in event.deleted_ids if i not in attributed]
+                if unattributed:
+                    spilled = await asyncio.to_thread(self.message_buffer.locate_spilled, unattributed, candidates)
+                    for chat_id, ids in spilled.items():
+                        targets[chat_id].extend(ids)
+
+        for chat_id, deleted_ids in targets.items():
+            monitor = self.event_monitors[chat_id]
+            try:
+                recovered, missing = self.message_buffer.pop(chat_id, deleted_ids)
+                if missing:
+                    recovered.update(await asyncio.to_thread(self.message_buffer.pop_spilled, chat_id, missing))
+                self.message_buffer.record_outcome(len(recovered), len(deleted_ids) - len(recovered))
+                monitor['delete_count'] += 1
+
+                alert = f"🗑️ <b>MESSAGE(S) DELETED</b>\n"
+                alert += f"<b>Channel:</b> {monitor['name']}\n"
+                alert += f"<b>Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                alert += f"<b>Deleted Message IDs:</b> {deleted_ids}\n"
+
+                for msg_id in deleted_ids:
+                    if msg_id not in recovered:
+                        continue
+                    date, sender_id, sender_name, text, media_ref = recovered[msg_id]
+                    alert += f"\n<b>#{msg_id}</b> "
+                    alert += f"{html.escape(sender_name or str(sender_id or 'Unknown'))} "
+                    alert += f"({datetime.fromtimestamp(date).strftime('%Y-%m-%d %H:%M')})\n"
+                    if text:
+                        alert += f"{html.escape(text[:500])}\n"
+                    if media_ref:
+                        alert += f"📎 <code>{html.escape(media_ref)}</code>\n"
+
+                if len(recovered) < len(deleted_ids):
+                    alert += f"\n<i>⚠️ Original content not recoverable for {len(deleted_ids) - len(recovered)} message(s)</i>"
+
+                await self.send_long_message('me', alert, parse_mode='html', priority=SEND_PRIORITY_ALERT)
+            except Exception as e:
+                logger.error(f"Delete event handling failed: {e}")
 
     async def handle_send_command(self, event):
         """
@@ -1262,7 +4271,7 @@ Original content below:
             await event.edit(f"📤 <i>Sending message to {target}...</i>", parse_mode='html')
 
             entity = await self.client.get_entity(target)
-            await self.client.send_message(entity, message)
+            await self.outbound.send_message(entity, message)
 
             target_name = getattr(entity, 'title', getattr(entity, 'username', target))
 
@@ -1278,22 +4287,35 @@ Original content below:
     async def handle_global_search_command(self, event):
         """
         Global search across ALL user's chats
-        Syntax: .global-search <keyword> [--limit N]
+        Syntax: .global-search <query> [--from @user] [--after YYYY-MM-DD] [--before YYYY-MM-DD] [--limit N] [--network]
+        Archived chats are answered from the local full-text index (phrases, prefix*,
+        BM25 ranking); Telegram's global search covers only the chats that aren't indexed.
         """
         parts = event.message.text.split()
 
         if len(parts) < 2:
             await event.edit(
                 "<b>⚠️ GLOBAL-SEARCH Usage:</b>\n"
-                "<code>.global-search &lt;keyword&gt; [--limit N]</code>\n\n"
+                "<code>.global-search &lt;query&gt; [--from @user] [--after YYYY-MM-DD] [--before YYYY-MM-DD] [--limit N] [--network]</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.global-search crypto</code>\n"
-                "<code>.global-search urgent --limit 50</code>"
+                "<code>.global-search urgent --limit 50</code>\n"
+                "<code>.global-search \"rug pull\" --after 2025-01-01</code>\n"
+                "<code>.global-search scam* --from @john</code>"
             , parse_mode='html')
             return
 
-        keyword = parts[1]
+        # Everything up to the first flag is the query, so phrases can span words
+        query_parts = []
+        for part in parts[1:]:
+            if part.startswith('--'):
+                break
+            query_parts.append(part)
+        keyword = ' '.join(query_parts)
         limit = 100
+        from_user = None
+        after_date = before_date = None
+        use_index = '--network' not in parts
 
         if '--limit' in parts:
             try:
@@ -1302,13 +4324,65 @@ Original content below:
             except:
                 pass
 
+        if '--from' in parts:
+            try:
+                from_user = parts[parts.index('--from') + 1].lstrip('@')
+            except:
+                pass
+
+        for flag in ('--after', '--before'):
+            if flag in parts:
+                try:
+                    parsed = datetime.strptime(parts[parts.index(flag) + 1], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                    if flag == '--after':
+                        after_date = parsed
+                    else:
+                        before_date = parsed
+                except:
+                    pass
+
+        if not keyword:
+            await event.edit("❌ <b>Missing search query</b>", parse_mode='html')
+            return
+
         await event.edit(f"🔍 <b>GLOBAL SEARCH ACTIVE</b>\n<i>Searching all chats for: {keyword}</i>", parse_mode='html')
 
         try:
             results = []
-            async for message in self.client.iter_messages(None, search=keyword, limit=limit):
-                chat = await message.get_chat()
-                sender = await message.get_sender()
+            facets = None
+            indexed_chats = set(self.archive.chat_ids) if use_index else set()
+
+            # Indexed chats: ranked local full-text search
+            if indexed_chats:
+                local_results, facets = await asyncio.to_thread(
+                    self.archive.search, keyword, None, from_user, after_date, before_date, limit
+                )
+                for res in local_results:
+                    results.append({
+                        'chat': res['chat_title'],
+                        'sender': res['sender_name'],
+                        'text': res['text'],
+                        'date': res['timestamp'],
+                        'message_id': res['id']
+                    })
+            local_count = len(results)
+
+            # Everything else: Telegram's global search, filling up to the same overall limit
+            async for message in self.client.iter_messages(None, search=keyword.replace('"', '').rstrip('*'), limit=limit):
+                if len(results) >= limit:
+                    break
+                if message.chat_id in indexed_chats:
+                    continue
+                if after_date and message.date < after_date:
+                    continue
+                if before_date and message.date > before_date:
+                    continue
+
+                chat = await self.resolve_chat(message)
+                sender = await self.resolve_sender(message)
+
+                if from_user and getattr(sender, 'username', None) != from_user:
+                    continue
 
                 chat_name = getattr(chat, 'title', getattr(chat, 'username', 'Unknown'))
                 sender_name = getattr(sender, 'first_name', 'Unknown') if sender else "Unknown"
@@ -1328,13 +4402,18 @@ Original content below:
             # Format results
             report = f"🔍 <b>GLOBAL SEARCH RESULTS</b>\n"
             report += f"<b>Keyword:</b> {keyword}\n"
-            report += f"<b>Found:</b> {len(results)} message(s)\n\n"
-            report += "="*40 + "\n\n"
+            report += f"<b>Found:</b> {len(results)} message(s)\n"
+            if indexed_chats:
+                report += f"<b>Local Index:</b> {local_count} shown of {facets['total']} match(es) in {len(indexed_chats)} archived chat(s)\n"
+                report += f"<b>Network:</b> {len(results) - local_count} from non-indexed chats\n"
+                if facets['chats']:
+                    report += f"<b>Top Chats:</b> {', '.join(f'{name} ({n})' for name, n in facets['chats'])}\n"
+            report += "\n" + "="*40 + "\n\n"
 
             for i, res in enumerate(results[:50], 1):  # Limit display to 50
                 report += f"<b>#{i} - {res['chat']}</b>\n"
                 report += f"👤 {res['sender']} | 📅 {res['date']}\n"
-                report += f"{res['text'][:200]}\n\n"
+                report += f"{(res['text'] or '')[:200]}\n\n"
 
             if len(results) > 50:
                 report += f"\n<i>... and {len(results) - 50} more results</i>"
@@ -1497,7 +4576,7 @@ Original content below:
     async def handle_detect_spam_command(self, event):
         """
         Scan channel for spam/bots
-        Syntax: .detect-spam <target> [--limit N] [--auto-report]
+        Syntax: .detect-spam <target> [--limit N] [--no-cache]
         """
         msg_text = event.message.text
         parts = msg_text.split()
@@ -1505,7 +4584,7 @@ Original content below:
         if len(parts) < 2:
             await event.edit(
                 "<b>⚠️ DETECT-SPAM Usage:</b>\n"
-                "<code>.detect-spam &lt;target&gt; [--limit N]</code>\n\n"
+                "<code>.detect-spam &lt;target&gt; [--limit N] [--no-cache]</code>\n\n"
                 "<b>Example:</b>\n"
                 "<code>.detect-spam @channel --limit 100</code>"
             , parse_mode='html')
@@ -1513,6 +4592,7 @@ Original content below:
 
         target = parts[1]
         limit = 100
+        use_cache = '--no-cache' not in parts
 
         if '--limit' in parts:
             try:
@@ -1531,27 +4611,27 @@ Original content below:
             entity = await self.client.get_entity(target)
             chat_title = getattr(entity, 'title', getattr(entity, 'username', target))
 
-            spam_results = []
-
+            # Gather first, then classify in concurrent batches
+            scanned = []
             async for msg in self.client.iter_messages(entity, limit=limit):
                 if msg.text:
-                    sender = await msg.get_sender()
-                    sender_data = {
-                        'username': getattr(sender, 'username', '') if sender else '',
-                        'first_name': getattr(sender, 'first_name', '') if sender else '',
-                        'is_bot': getattr(sender, 'bot', False) if sender else False
-                    }
-
-                    is_spam, confidence, reason = await self.ai.detect_spam_bot(msg.text, sender_data)
-
-                    if is_spam and confidence > 0.7:
-                        spam_results.append({
-                            'message_id': msg.id,
-                            'sender': sender_data['username'] or sender_data['first_name'],
-                            'confidence': confidence,
-                            'reason': reason,
-                            'text': msg.text[:100]
-                        })
+                    sender = await self.resolve_sender(msg)
+                    scanned.append((msg, self._spam_sender_data(sender)))
+
+            verdicts = await self.ai.detect_spam_batch(
+                [(msg.text, sender_data) for msg, sender_data in scanned], use_cache=use_cache
+            )
+
+            spam_results = []
+            for (msg, sender_data), (is_spam, confidence, reason) in zip(scanned, verdicts):
+                if is_spam and confidence > 0.7:
+                    spam_results.append({
+                        'message_id': msg.id,
+                        'sender': sender_data['username'] or sender_data['first_name'],
+                        'confidence': confidence,
+                        'reason': reason,
+                        'text': msg.text[:100]
+                    })
 
             # Generate report
             report = f"🛡️ <b>SPAM DETECTION REPORT</b>\n"
@@ -1579,6 +4659,17 @@ Original content below:
         except Exception as e:
             await event.edit(f"❌ <b>Spam detection failed:</b> {str(e)}", parse_mode='html')
 
+    @staticmethod
+    def _spam_sender_data(sender) -> Dict:
+        """Sender metadata used by the spam pre-filter and classifier"""
+        return {
+            'username': getattr(sender, 'username', '') if sender else '',
+            'first_name': getattr(sender, 'first_name', '') if sender else '',
+            'is_bot': getattr(sender, 'bot', False) if sender else False,
+            'id': sender.id if sender else None,
+            'has_photo': getattr(sender, 'photo', None) is not None if sender else None
+        }
+
     async def handle_auto_mod_command(self, event):
         """
         Enable auto-moderation (requires admin rights)
@@ -1600,7 +4691,7 @@ Original content below:
 
         target = parts[1]
         delete_spam = '--delete-spam' in msg_text
-        ban_threshold = 0.9
+        ban_threshold = AUTOMOD_BAN_THRESHOLD
 
         if '--ban-threshold' in parts:
             try:
@@ -1623,26 +4714,34 @@ Original content below:
                 'banned_count': 0
             }
 
-            # Register handler
-            @self.client.on(events.NewMessage(chats=entity))
             async def auto_mod_handler(event):
                 msg = event.message
                 if msg.text:
-                    sender = await msg.get_sender()
-                    sender_data = {
-                        'username': getattr(sender, 'username', '') if sender else '',
-                        'first_name': getattr(sender, 'first_name', '') if sender else '',
-                        'is_bot': getattr(sender, 'bot', False) if sender else False,
-                        'id': sender.id if sender else None
-                    }
-
-                    is_spam, confidence, reason = await self.ai.detect_spam_bot(msg.text, sender_data)
+                    sender = await self.resolve_sender(msg)
+                    sender_data = self._spam_sender_data(sender)
+
+                    # Reputation short-circuits: known spammers are actioned, regulars skipped
+                    standing = self.reputation.standing(sender_data['id'])
+                    if standing == 'trusted':
+                        self.reputation.skipped_trusted += 1
+                        return
+                    if standing == 'bad':
+                        self.reputation.actioned_bad += 1
+                        is_spam, confidence, reason = True, 1.0, "Known spammer (sender reputation)"
+                    else:
+                        (is_spam, confidence, reason), source = await self.spam_batcher.classify_with_source(
+                            msg.text, sender_data, event.chat_id, msg.id
+                        )
+                        await asyncio.to_thread(
+                            self.reputation.record_verdict, sender_data['id'], is_spam, confidence, source
+                        )
 
                     if is_spam and confidence >= ban_threshold:
                         if mod_rule['delete_spam']:
                             try:
                                 await msg.delete()
                                 mod_rule['deleted_count'] += 1
+                                await asyncio.to_thread(self.reputation.record_deletion, sender_data['id'])
                                 logger.info(f"Auto-deleted spam message in {mod_rule['chat_name']}")
 
                                 # Alert user
@@ -1651,11 +4750,16 @@ Original content below:
                                 alert += f"<b>Action:</b> Deleted spam\n"
                                 alert += f"<b>Confidence:</b> {confidence*100:.0f}%\n"
                                 alert += f"<b>Reason:</b> {reason}"
-                                await self.client.send_message('me', alert, parse_mode='html')
+                                await self.outbound.send_message(
+                                    'me', alert, parse_mode='html', priority=SEND_PRIORITY_ALERT
+                                )
 
                             except Exception as e:
                                 logger.error(f"Auto-mod delete failed: {e}")
 
+            if chat_title in self.auto_mod_rules:
+                self.router.remove(self.auto_mod_rules[chat_title]['rule_id'])
+            mod_rule['rule_id'] = self.router.add(utils.get_peer_id(entity), 'auto-mod', auto_mod_handler)
             self.auto_mod_rules[chat_title] = mod_rule
 
             await event.edit(
@@ -1697,7 +4801,10 @@ Original content below:
             # Single message delete
             if parts[2].isdigit():
                 message_id = int(parts[2])
+                target_msg = await self.client.get_messages(entity, ids=message_id)
                 await self.client.delete_messages(entity, message_id)
+                if target_msg:
+                    await asyncio.to_thread(self.reputation.record_deletion, target_msg.sender_id, True)
                 await event.edit(f"✅ <b>Message {message_id} deleted</b>", parse_mode='html')
 
             # Bulk delete by keyword
@@ -1715,14 +4822,18 @@ Original content below:
 
                 deleted = 0
                 to_delete = []
+                senders = []
 
                 async for msg in self.client.iter_messages(entity, limit=limit):
                     if msg.text and keyword.lower() in msg.text.lower():
                         to_delete.append(msg.id)
+                        senders.append(msg.sender_id)
 
                 if to_delete:
                     await self.client.delete_messages(entity, to_delete)
                     deleted = len(to_delete)
+                    for sender_id in senders:
+                        await asyncio.to_thread(self.reputation.record_deletion, sender_id, True)
 
                 await event.edit(
                     f"✅ <b>BULK DELETE COMPLETE</b>\n"
@@ -1736,19 +4847,61 @@ Original content below:
     async def handle_schedule_report_command(self, event):
         """
         Schedule automated intelligence reports
-        Syntax: .schedule-report <target> <frequency> [--keywords kw1,kw2]
+        Syntax: .schedule-report <target> <frequency> [--keywords kw1,kw2] [--whole-words] [--since 3d]
+                .schedule-report list | .schedule-report cancel <id>
         Frequency: daily, weekly, hourly
+        --since sets the window the first report covers; later runs pick up from the last one.
         """
-        parts = event.message.text.split()
+        try:
+            window, parts = self._parse_time_window(event.message.text.split())
+        except ValueError as e:
+            await event.edit(f"❌ <b>Error:</b> {html.escape(str(e))}", parse_mode='html')
+            return
+        if 'before_date' in window:
+            await event.edit("❌ <b>Error:</b> scheduled reports only take --since", parse_mode='html')
+            return
 
-        if len(parts) < 3:
+        if len(parts) >= 2 and parts[1] == 'list':
+            jobs = self.jobs.list('report')
+            if not jobs:
+                await event.edit("❌ No scheduled reports", parse_mode='html')
+                return
+            report = f"⏰ <b>SCHEDULED REPORTS</b>\n\n"
+            for job in jobs:
+                params = job['params']
+                last_run = datetime.fromtimestamp(job['last_run']).strftime('%Y-%m-%d %H:%M') if job['last_run'] else 'never'
+                report += f"<b>#{job['id']}</b> {html.escape(params['chat_title'])} ({job['frequency']})\n"
+                if params['keywords']:
+                    report += f"   Keywords: {html.escape(', '.join(params['keywords']))}\n"
+                report += f"   Next: {datetime.fromtimestamp(job['run_at']).strftime('%Y-%m-%d %H:%M')} | Last: {last_run}\n"
+                if job['state'].get('max_id') is not None:
+                    report += f"   Watermark: #{job['state']['max_id']} | Reported: {job['state'].get('messages_total', 0)} message(s)\n"
+            await event.edit(report, parse_mode='html')
+            return
+
+        if len(parts) >= 2 and parts[1] == 'cancel':
+            try:
+                job_id = int(parts[2])
+            except:
+                await event.edit("<b>⚠️ Usage:</b> <code>.schedule-report cancel &lt;id&gt;</code>", parse_mode='html')
+                return
+            if self.jobs.jobs.get(job_id, {}).get('kind') == 'report' and self.jobs.cancel(job_id):
+                await event.edit(f"✅ Cancelled scheduled report #{job_id}", parse_mode='html')
+            else:
+                await event.edit(f"❌ No scheduled report #{job_id}", parse_mode='html')
+            return
+
+        if len(parts) < 3 or parts[2] not in JOB_FREQUENCIES:
             await event.edit(
                 "<b>⚠️ SCHEDULE-REPORT Usage:</b>\n"
-                "<code>.schedule-report &lt;target&gt; &lt;frequency&gt; [--keywords kw1,kw2]</code>\n\n"
+                "<code>.schedule-report &lt;target&gt; &lt;frequency&gt; [--keywords kw1,kw2] [--whole-words] [--since 3d]</code>\n"
+                "<code>.schedule-report list</code>\n"
+                "<code>.schedule-report cancel &lt;id&gt;</code>\n\n"
                 "<b>Frequency:</b> hourly, daily, weekly\n\n"
                 "<b>Examples:</b>\n"
                 "<code>.schedule-report @channel daily</code>\n"
-                "<code>.schedule-report @intel_source hourly --keywords crypto,urgent</code>"
+                "<code>.schedule-report @intel_source hourly --keywords crypto,urgent</code>\n"
+                "<code>.schedule-report @channel weekly --since 14d</code>"
             , parse_mode='html')
             return
 
@@ -1767,63 +4920,131 @@ Original content below:
             entity = await self.client.get_entity(target)
             chat_title = getattr(entity, 'title', getattr(entity, 'username', target))
 
-            async def generate_report():
-                # Determine limit based on frequency
-                limit = 100 if frequency == 'hourly' else 500 if frequency == 'daily' else 1000
-
-                # Fetch data
-                filters = {}
-                if keywords:
-                    # Will need to check each message for any keyword
-                    pass
-
-                chat_title_local, history_data, raw_messages = await self.fetch_history(target, limit)
-
-                if history_data and not history_data.startswith("❌"):
-                    # Generate AI report
-                    report_prompt = f"Generate an executive intelligence summary of recent activity. Focus on key events, trends, and actionable insights."
-                    ai_report = await self.ai.analyze_content(history_data, report_prompt, extract_entities=True)
-
-                    # Send to saved messages
-                    report_msg = f"📊 <b>SCHEDULED INTELLIGENCE REPORT</b>\n"
-                    report_msg += f"<b>Source:</b> {chat_title_local}\n"
-                    report_msg += f"<b>Frequency:</b> {frequency}\n"
-                    report_msg += f"<b>Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                    report_msg += f"<b>Messages Analyzed:</b> {len(raw_messages)}\n\n"
-                    report_msg += ai_report
-
-                    await self.send_long_message('me', report_msg, parse_mode='html')
-
-            # Schedule the report
-            if frequency == 'hourly':
-                schedule.every().hour.do(lambda: asyncio.create_task(generate_report()))
-            elif frequency == 'daily':
-                schedule.every().day.at("09:00").do(lambda: asyncio.create_task(generate_report()))
-            elif frequency == 'weekly':
-                schedule.every().monday.at("09:00").do(lambda: asyncio.create_task(generate_report()))
-
-            self.scheduled_reports.append({
-                'target': chat_title,
-                'frequency': frequency,
-                'keywords': keywords
+            job = await self.jobs.add('report', frequency, {
+                'target': target,
+                'chat_title': chat_title,
+                'keywords': keywords,
+                'whole_words': '--whole-words' in parts,
+                'seed_since': round((datetime.now(timezone.utc) - window['after_date']).total_seconds()) if window else None
             })
 
             await event.edit(
-                f"⏰ <b>SCHEDULED REPORT ACTIVE</b>\n"
+                f"⏰ <b>SCHEDULED REPORT ACTIVE</b> (#{job['id']})\n"
                 f"<b>Target:</b> {chat_title}\n"
                 f"<b>Frequency:</b> {frequency}\n"
-                f"<b>Keywords:</b> {', '.join(keywords) if keywords else 'All'}\n\n"
+                f"<b>Keywords:</b> {', '.join(keywords) if keywords else 'All'}\n"
+                f"<b>First Report Covers:</b> {self._describe_scope(None if window else REPORT_SEED_LIMITS[frequency], window)}\n"
+                f"<b>First Run:</b> {datetime.fromtimestamp(job['run_at']).strftime('%Y-%m-%d %H:%M')}\n\n"
                 f"Reports will be sent to Saved Messages."
             , parse_mode='html')
 
         except Exception as e:
             await event.edit(f"❌ <b>Schedule failed:</b> {str(e)}", parse_mode='html')
 
-    def _run_scheduler(self):
-        """Background thread for scheduled tasks"""
-        while True:
-            schedule.run_pending()
-            time.sleep(60)
+    async def _run_scheduled_report(self, job: Dict):
+        """
+        Job runner for .schedule-report. Each run reads only messages above the job's
+        max_id watermark, reports on that delta and folds it into a rolling summary;
+        the watermark only advances once the report has been delivered, and only as
+        far as the last message read, since a run reads at most REPORT_RUN_WINDOWS
+        seed windows' worth.
+        """
+        params = job['params']
+        state = job['state']
+        frequency = job['frequency']
+        keywords = params['keywords']
+        matcher = KeywordMatcher(keywords, params.get('whole_words', False)) if keywords else None
+
+        entity, chat_title = await self.resolve_target(params['target'])
+        watermark = state.get('max_id')
+
+        seed_limit = REPORT_SEED_LIMITS.get(frequency, 500)
+        run_limit = seed_limit * REPORT_RUN_WINDOWS
+
+        if watermark is None:
+            # First run: seed from the --since window, or the usual window for this frequency
+            window = None
+            if params.get('seed_since'):
+                window = {'after_date': datetime.now(timezone.utc) - timedelta(seconds=params['seed_since'])}
+            messages = []
+            async for batch in self.iter_history_batches(
+                entity, chat_title, WINDOW_SCAN_LIMIT if window else seed_limit, filters=window
+            ):
+                messages.extend(batch)
+            backlog = False
+        else:
+            # Oldest first and capped, so a long backlog is worked off over several runs
+            messages = [
+                await self._message_record(msg)
+                async for msg in self.client.iter_messages(entity, limit=run_limit, min_id=watermark, reverse=True)
+            ]
+            backlog = len(messages) >= run_limit
+
+        new_max_id = messages[-1]['id'] if messages else watermark
+        fetched = len(messages)
+
+        # Narrow the report to messages hitting any keyword
+        keyword_hits = Counter()
+        if matcher:
+            matching = []
+            for m in messages:
+                hits = matcher.find(m['text'])
+                if hits:
+                    keyword_hits.update(hits)
+                    matching.append(m)
+            messages = matching
+
+        history_data = "\n".join(
+            f"[{m['timestamp']}] {m['sender_name']}: {m['text']}" for m in messages if m['text']
+        )
+
+        if not history_data:
+            # Nothing to report; still move past what was checked
+            logger.info(f"Scheduled report #{job['id']}: no new activity in {chat_title} ({fetched} checked)")
+            state['max_id'] = new_max_id
+            return
+
+        # Generate AI report on the delta only
+        report_prompt = (
+            "Generate an executive intelligence summary of the activity since the last report. "
+            "Focus on key events, trends, and actionable insights."
+        )
+        ai_report = await self.ai.analyze_content(
+            history_data, report_prompt, extract_entities=True, priority=PRIORITY_REPORT
+        )
+        if ai_report.startswith("⚠️"):
+            raise RuntimeError(f"delta report failed for {chat_title}: {ai_report}")
+
+        running_summary = state.get('summary')
+        if running_summary:
+            running_summary = await self.ai.fold_summary(running_summary, ai_report)
+            if running_summary.startswith("⚠️"):
+                raise RuntimeError(f"rolling summary failed for {chat_title}: {running_summary}")
+        else:
+            running_summary = ai_report
+
+        # Send to saved messages
+        report_msg = f"📊 <b>SCHEDULED INTELLIGENCE REPORT</b>\n"
+        report_msg += f"<b>Source:</b> {chat_title}\n"
+        report_msg += f"<b>Frequency:</b> {frequency}\n"
+        report_msg += f"<b>Time:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        report_msg += f"<b>New Messages Analyzed:</b> {len(messages)}"
+        if watermark is not None:
+            report_msg += f" (since #{watermark})"
+        report_msg += "\n"
+        if backlog:
+            report_msg += f"<b>Backlog:</b> run limit of {run_limit} reached at #{new_max_id}; newer messages follow next run\n"
+        if keyword_hits:
+            report_msg += f"<b>Keyword Hits:</b> {', '.join(f'{kw} ({n})' for kw, n in keyword_hits.most_common())}\n"
+        report_msg += f"\n<b>What's New:</b>\n{ai_report}"
+        if state.get('summary'):
+            report_msg += f"\n\n<b>Running Summary:</b>\n{running_summary}"
+
+        await self.send_long_message('me', report_msg, parse_mode='html', priority=SEND_PRIORITY_BULK)
+
+        state['max_id'] = new_max_id
+        state['summary'] = running_summary
+        state['messages_total'] = state.get('messages_total', 0) + len(messages)
 
 
 # --- EXECUTION ---
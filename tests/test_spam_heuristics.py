@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("google.generativeai")
+
+from atlas_agent import SpamHeuristics
+
+SENDER = {'username': 'someone', 'first_name': 'Some', 'is_bot': False, 'has_photo': True}
+
+
+def hosts(text):
+    return [m.group(1) or m.group(2) for m in SpamHeuristics.URL_RE.finditer(text)]
+
+
+def test_file_names_are_not_links():
+    assert hosts("see report.pdf") == []
+    score, reasons = SpamHeuristics().score("see report.pdf, notes.txt and setup.exe", SENDER)
+    assert not any('link' in reason for reason in reasons)
+
+
+def test_versions_and_abbreviations_are_not_links():
+    assert hosts("v1.2.3 is out, e.g. with fixes for main.py") == []
+
+
+def test_real_links_are_still_found():
+    assert hosts("https://evil.example/path www.foo.bar bit.ly/x sub.domain.ru") == [
+        'evil.example', 'foo.bar', 'bit.ly', 'sub.domain.ru'
+    ]
+    assert hosts("mail john@gmail.com") == []
+
+
+def test_blocked_domain_matches_bare_host():
+    heuristics = SpamHeuristics()
+    heuristics.blocked_domains = {'scam.xyz'}
+    score, reasons = heuristics.score("claim at promo.scam.xyz today", SENDER)
+    assert "blocked domain promo.scam.xyz" in reasons
+
+
+def test_plain_prose_spam_is_escalated_not_settled_clean():
+    text = "Join our VIP signals group for guaranteed 300% profit, contact admin now"
+    assert SpamHeuristics().settle(text, SENDER) is None
+
+
+def test_short_chat_from_established_sender_settles_clean():
+    is_spam, confidence, reason = SpamHeuristics().settle("ok see you tomorrow", SENDER)
+    assert not is_spam
+    assert confidence <= 0.15
+
+
+@pytest.mark.parametrize('text', [
+    "check example.com later",
+    "ask @someadmin about it",
+    "only $50 today",
+    "this message is a little too long to count as plain chat",
+])
+def test_short_messages_with_spam_vectors_are_escalated(text):
+    assert SpamHeuristics().settle(text, SENDER) is None
+
+
+@pytest.mark.parametrize('sender', [
+    dict(SENDER, username=None),
+    dict(SENDER, has_photo=False),
+    dict(SENDER, is_bot=True),
+    dict(SENDER, id=9_000_000_000),
+])
+def test_unestablished_senders_are_escalated(sender):
+    assert SpamHeuristics().settle("ok see you tomorrow", sender) is None
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("telethon")
+pytest.importorskip("google.generativeai")
+
+import atlas_agent
+from atlas_agent import AtlasClient, SenderCache
+
+NOW = datetime.now(timezone.utc)
+
+
+class FakeMessage:
+    def __init__(self, msg_id, date):
+        self.id = msg_id
+        self.date = date
+        self.text = f"message {msg_id}"
+        self.sender = None
+        self.sender_id = None
+        self.media = None
+
+    async def get_sender(self):
+        return None
+
+
+class FakeClient:
+    """Models the Telethon history semantics iter_history_batches relies on"""
+
+    def __init__(self, messages):
+        self.messages = messages  # oldest first
+        self.yielded = 0
+
+    async def get_messages(self, entity, limit=1, add_offset=0, offset_date=None):
+        newest_first = [m for m in reversed(self.messages) if offset_date is None or m.date < offset_date]
+        return newest_first[add_offset:add_offset + limit]
+
+    async def iter_messages(self, entity, limit=None, min_id=0, offset_date=None, reverse=False):
+        assert reverse
+        if min_id:
+            # offset_id=min_id+1 takes priority over offset_date
+            offset_date = None
+        candidates = [
+            m for m in self.messages
+            if m.id > min_id and (offset_date is None or m.date > offset_date)
+        ]
+        for msg in candidates[:limit]:
+            self.yielded += 1
+            yield msg
+
+
+def hourly_chat(count):
+    """`count` messages, one per hour, the newest one from half an hour ago"""
+    return [
+        FakeMessage(i, NOW - timedelta(minutes=30) - timedelta(hours=count - i))
+        for i in range(1, count + 1)
+    ]
+
+
+def scan(client, limit, window):
+    atlas = AtlasClient.__new__(AtlasClient)
+    atlas.client = client
+    atlas.sender_cache = SenderCache()
+
+    async def collect():
+        records = []
+        async for batch in atlas.iter_history_batches(object(), "chat", limit, filters=window):
+            records.extend(batch)
+        return records
+
+    return asyncio.run(collect())
+
+
+def test_window_smaller_than_limit_reads_only_the_window():
+    client = FakeClient(hourly_chat(200))
+    window, _ = AtlasClient._parse_time_window(["--since", "24h"])
+
+    records = scan(client, 100, window)
+
+    assert len(records) == 24
+    assert all(r['date'] >= window['after_date'] for r in records)
+    assert client.yielded == 24
+
+
+def test_window_larger_than_limit_keeps_newest_limit():
+    client = FakeClient(hourly_chat(200))
+    window, _ = AtlasClient._parse_time_window(["--since", "7d"])
+
+    records = scan(client, 50, window)
+
+    assert [r['id'] for r in records] == list(range(151, 201))
+    assert client.yielded == 50
+
+
+def test_between_window_is_bounded_on_both_sides():
+    client = FakeClient(hourly_chat(200))
+    window = {
+        'after_date': NOW - timedelta(hours=48),
+        'before_date': NOW - timedelta(hours=24),
+    }
+
+    records = scan(client, atlas_agent.WINDOW_SCAN_LIMIT, window)
+
+    assert len(records) == 24
+    assert all(window['after_date'] <= r['date'] <= window['before_date'] for r in records)